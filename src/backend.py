@@ -5,16 +5,34 @@ Backend would be responsible
 - for creating algorithms like Dijkstra
 '''
 
+import hashlib
+import heapq
 import numpy as np
 import pandas as pd
 import os
+import tempfile
 import time
+import threading
+import zipfile
+from collections import OrderedDict
+from spatial import GeoIndex
+from fuzzy import FuzzyIndex
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 dir_path = os.path.join(dir_path, "..", "data")
 
 #paramters
 CLOSE_STATIONS = 40
+UNREACHED = 1000000   # distance of stations not reached by Dijkstra
+NO_PREV = "ABC"      # previous station of stations not reached by Dijkstra
+ROUTING_METHODS = ("dijkstra", "csr", "apsp", "astar", "bidirectional", "ch")
+ROUTING_METHOD = "csr"   # default method of findPath
+APSP_MAX_BYTES = 64 * 1024 * 1024   # largest all pairs matrix kept, bigger graphs search on demand
+ROUTE_CACHE_SIZE = 1024   # number of routes remembered by findPath
+TREE_CACHE_SIZE = 64      # number of single source dist/prev trees remembered by findPath
+EARTH_RADIUS = 3956       # earth's radius in miles
+SNAPSHOT_VERSION = 1      # increase whenever the snapshot layout changes, older snapshots get rebuilt
+STATION_COLUMNS = ["address1", "address2", "city", "state", "zipcode", "Full_Address", "Latitude", "Longitude", "code"]
 
 def DataLoading(*filepath):
     '''
@@ -22,17 +40,12 @@ def DataLoading(*filepath):
     return: [dataframe] train_info_, [Graph] graph_
     processing the data to create dataframes and graph, using helper functions
     '''
-    traindata = pd.read_csv(filepath[0])
-    newtraindata = traindata[["Latitude", "Longitude", "code"]]
-    latandlong = traindata[["Latitude", "Longitude"]]
-    formattedtraindata = traindata[["code"]].to_numpy()
-    coordinates = latandlong.values.tolist()
-    station_to_cords = {}
-    
-    # in this for loop I am populating the dictionary station_to_cords with the correct data
-    for i, j in zip(formattedtraindata, coordinates):
-        station_to_cords[i[0]] = j
-    
+    traindata = pd.read_csv(filepath[0], usecols=STATION_COLUMNS, dtype={"zipcode": str, "code": str})[STATION_COLUMNS]
+    coordinates = traindata[["Latitude", "Longitude"]].values.tolist()
+
+    # populating the dictionary station_to_cords with the correct data
+    station_to_cords = dict(zip(traindata["code"].tolist(), coordinates))
+
     # calling the creategraph helper function to fill in the graph_ variable with the correct data
     graph_ = CreateGraph(station_to_cords, filepath[1])
     return traindata, graph_
@@ -57,11 +70,26 @@ def Distance(coordinate1, coordinate2):
     a = (np.sin(latdif / 2)) ** 2 + np.cos(lat1) * np.cos(lat2) * (np.sin(longdif / 2)) ** 2
     c = 2 * np.arcsin(np.sqrt(a))
     
-    # earth's radius in miles
-    radius = 3956
-    
     # returns the distance in miles between the two coordiantes (arclength)
-    return (c * radius)
+    return (c * EARTH_RADIUS)
+
+
+def DistanceBatch(coordinates1, coordinates2):
+    '''
+    input: [array of shape (n, 2): latitudes and longitudes] coordinates1, same for coordinates2
+           (either can also be a single coordinate, it's broadcast against the other)
+    return: [array of shape (n,)] The distance in miles between each pair of coordinates
+    same formula as Distance, computed for all pairs in one pass of numpy operations.
+    '''
+    coordinates1 = np.radians(np.asarray(coordinates1, dtype=np.float64))
+    coordinates2 = np.radians(np.asarray(coordinates2, dtype=np.float64))
+    lat1 = coordinates1[..., 0]
+    lat2 = coordinates2[..., 0]
+    latdif = lat2 - lat1
+    longdif = coordinates2[..., 1] - coordinates1[..., 1]
+
+    a = np.sin(latdif / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(longdif / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
 
 
 def CreateGraph(data, filepath):
@@ -72,13 +100,9 @@ def CreateGraph(data, filepath):
     Ideally we need constant time access to each connection. 
     '''
 
-    connections = pd.read_csv(filepath)
-    columns = []
-    
-    for i in connections.columns:
-        columns.append(i)
-    
-    columns = columns[1:] # columns = [Connection1 Connection2 Connection3 Connection4 Connection5]
+    # keep_default_na=False, newer pandas would read "None" as NaN
+    connections = pd.read_csv(filepath, dtype=str, keep_default_na=False)
+    columns = list(connections.columns)[1:] # columns = [Connection1 Connection2 Connection3 Connection4 Connection5]
 
     station_names = connections["code"].to_numpy()
     connected_stations = connections[columns].to_numpy()
@@ -89,16 +113,29 @@ def CreateGraph(data, filepath):
     for stn in station_names:
         graph_.add_station(stn, data[stn])
 
+    # connections of a station end at the first "None"
+    valid = np.cumprod((connected_stations != "None") & (connected_stations != ""), axis=1).astype(bool)
+    frm = np.broadcast_to(station_names[:, None], connected_stations.shape)[valid]
+    to = connected_stations[valid]
+
+    # looking up coordinates of both ends of every connection at once
+    codes = pd.Index(list(data))
+    coordinates = np.array(list(data.values()), dtype=np.float64)
+    frm_idx = codes.get_indexer(frm)
+    to_idx = codes.get_indexer(to)
+    if (frm_idx == -1).any() or (to_idx == -1).any():
+        missing = set(frm[frm_idx == -1]) | set(to[to_idx == -1])
+        raise ValueError("stations " + str(sorted(missing)) + " don't have coordinates")
+
+    # computing all distances in one vectorised pass
+    distances = DistanceBatch(coordinates[frm_idx], coordinates[to_idx])
+
     # adding connections
-    for stn, cnnctn in zip(station_names, connected_stations):
-        stn_cords = data[stn]
-        for con in cnnctn:
-            if (con == "None"):
-                break
-            con_cords = data[con]
-            distance = Distance(stn_cords, con_cords)
-            graph_.add_connection(stn, con, distance)
+    for stn, con, distance in zip(frm.tolist(), to.tolist(), distances.tolist()):
+        graph_.add_connection(stn, con, distance)
 
+    # building integer indexed view once, routing functions reuse it
+    graph_.get_csr()
     return graph_
 
 
@@ -147,6 +184,126 @@ def Validity(data, graph, verbose = 0):
 
 
 
+def DataHash(*filepath):
+    '''
+    input:  [filepaths of data] filepath = [train_data.csv, train_connections.csv]
+    return: [string] hex digest of the contents of all files
+    used as key of files cached from the data, changes whenever the data changes
+    '''
+    sha = hashlib.sha1()
+    for path in filepath:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+# raised when reading a damaged or half written cache file
+CACHE_ERRORS = (OSError, EOFError, ValueError, KeyError, SyntaxError, zipfile.BadZipFile)
+
+
+def SaveAtomic(path, write):
+    '''
+    input:  [string] path of the file, write(f) writing its contents into binary file f
+    writes next to path and renames it once complete, so an interrupted save never leaves half a file
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".part", "wb") as f:
+        write(f)
+    os.replace(path + ".part", path)
+
+
+def LoadOrBuild(path, load, build, save, checksum = None):
+    '''
+    input:  [string] path of the cache file, load(path) returning what it keeps (None if it's stale),
+            build() making it again, save(result, path) writing it (with SaveAtomic),
+            [string] checksum the loaded result must have as its checksum, None to not check it
+    output: result, [bool] true if it was loaded from path
+    a missing, stale or unreadable file is a cache miss, result is built and saved over it
+    '''
+    if os.path.exists(path):
+        try:
+            result = load(path)
+        except CACHE_ERRORS:
+            result = None
+        if result is not None and (checksum is None or result.checksum == checksum):
+            return result, True
+    result = build()
+    save(result, path)
+    return result, False
+
+
+def SaveSnapshot(path, data, graph, checksum):
+    '''
+    input:  [string] path of .npz file, [dataframe] data, [Graph] graph, [string] checksum of data files
+    saves station columns and the CSR arrays of the graph into one binary file, so next
+    launch can skip parsing csv files and computing distances.
+    '''
+    csr = graph.get_csr()
+    arrays = {"version": np.array(SNAPSHOT_VERSION), "checksum": np.array(checksum),
+              "graph_codes": np.array(csr.codes), "graph_coords": csr.coords,
+              "indptr": csr.indptr, "indices": csr.indices, "weights": csr.weights}
+    for column in STATION_COLUMNS:
+        values = data[column]
+        #text columns are object in older pandas and StringDtype from pandas 3
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            arrays["missing_" + column] = values.isna().to_numpy()
+            arrays["column_" + column] = values.astype(object).fillna("").to_numpy(dtype=str)
+        else:
+            arrays["column_" + column] = values.to_numpy()
+
+    SaveAtomic(path, lambda f: np.savez(f, **arrays))
+
+
+def LoadSnapshot(path, checksum):
+    '''
+    input:  [string] path of .npz file, [string] checksum of data files
+    return: [dataframe] train_info_, [Graph] graph_, or None if the snapshot is of an older version
+            or it was saved from different data files. raises one of CACHE_ERRORS if it can't be read
+    '''
+    with np.load(path, allow_pickle=False) as f:
+        if int(f["version"]) != SNAPSHOT_VERSION or str(f["checksum"]) != checksum:
+            return None
+        columns = {}
+        for column in STATION_COLUMNS:
+            values = f["column_" + column]
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+                values[f["missing_" + column]] = np.nan
+            columns[column] = values
+        csr = CSRGraph(f["graph_codes"].tolist(), f["graph_coords"], f["indptr"], f["indices"], f["weights"])
+    return pd.DataFrame(columns), Graph.from_csr(csr)
+
+
+def CheckSnapshot(data_path = dir_path, verbose = True):
+    '''
+    input:  [string] folder with train_data.csv and train_connections.csv, verbose
+    Saves snapshot of the csv data into a temporary folder, loads it back and checks it gives the same
+    stations and graph, and that a damaged snapshot is treated as missing and written again.
+    '''
+    files = (os.path.join(data_path, "train_data.csv"), os.path.join(data_path, "train_connections.csv"))
+    data, graph = DataLoading(*files)
+    checksum = DataHash(*files)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "snapshot.npz")
+        SaveSnapshot(path, data, graph, checksum)
+        loaded_data, loaded_graph = LoadSnapshot(path, checksum)
+        pd.testing.assert_frame_equal(loaded_data, data)
+        csr, loaded_csr = graph.get_csr(), loaded_graph.get_csr()
+        assert csr.codes == loaded_csr.codes
+        for name in ("coords", "indptr", "indices", "weights"):
+            assert np.array_equal(getattr(csr, name), getattr(loaded_csr, name)), name
+        assert LoadSnapshot(path, "another checksum") is None
+
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot")
+        result, loaded = LoadOrBuild(path, lambda path: LoadSnapshot(path, checksum), lambda: (data, graph),
+                                     lambda result, path: SaveSnapshot(path, *result, checksum))
+        assert not loaded and LoadSnapshot(path, checksum) is not None
+    if verbose: print("snapshot round trip:", len(data), "stations,", len(csr.indices), "connections, ok")
+
+
+
 class Station:
 
     # each station will be represented by station code, and will have connected stations dictionary
@@ -206,6 +363,8 @@ class Graph:
     def __init__(self):
         self.stations = {}
         self.num_stations = 0
+        self.csr = None
+        self.version = 0    # increases whenever graph changes, caches of routes compare against it
 
     # converts graph to a string so that it can be printed
     def __str__(self):
@@ -238,6 +397,8 @@ class Graph:
         self.num_stations = self.num_stations + 1
         new_station = Station(station_name, station_coords)
         self.stations[station_name] = new_station
+        self.csr = None
+        self.version += 1
         return new_station
 
     # return object of station given the code
@@ -255,6 +416,27 @@ class Graph:
             raise ValueError("to station is not in station directory")
 
         self.stations[frm].add_connection(to, dist)
+        self.csr = None
+        self.version += 1
+
+    # creates graph from a CSRGraph view, the view is kept so it's not built again
+    @classmethod
+    def from_csr(cls, csr):
+        graph = cls()
+        for code, coords in zip(csr.codes, csr.coords.tolist()):
+            graph.add_station(code, coords)
+        for i, code in enumerate(csr.codes):
+            connections = graph.stations[code].connections
+            for k in range(csr.indptr_list[i], csr.indptr_list[i + 1]):
+                connections[csr.codes[csr.indices_list[k]]] = csr.weights_list[k]
+        graph.csr = csr
+        return graph
+
+    # returns integer indexed CSRGraph view of the graph, rebuilt only after the graph changes
+    def get_csr(self):
+        if self.csr is None:
+            self.csr = CSRGraph.from_graph(self)
+        return self.csr
 
     # returns tuple of station objects
     def get_stations(self):
@@ -269,68 +451,854 @@ class Graph:
         return self.stations[i]
 
 
-data_, graph_ = DataLoading(os.path.join(dir_path, "train_data.csv"),os.path.join(dir_path, "train_connections.csv"))
-Validity(data_, graph_)
+class CSRGraph:
+
+    # compressed sparse row view of Graph. station i is codes[i], its neighbours are
+    # indices[indptr[i]:indptr[i+1]] at distances weights[indptr[i]:indptr[i+1]].
+    # index = {<station code>: <int i>}, coords[i] = [latitude, longitude]
+    def __init__(self, codes, coords, indptr, indices, weights):
+        self.codes = list(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        # python list copies, indexing numpy scalars one by one in a loop is slower than lists
+        self.indptr_list = self.indptr.tolist()
+        self.indices_list = self.indices.tolist()
+        self.weights_list = self.weights.tolist()
+        self.checksum = None
+        self.reversed = None
+
+    # creates the view from a Graph, stations keep the order they were added in
+    @classmethod
+    def from_graph(cls, graph):
+        codes = list(graph.stations)
+        index = {code: i for i, code in enumerate(codes)}
+        coords = np.empty((len(codes), 2))
+        indptr = np.zeros(len(codes) + 1, dtype=np.int64)
+        indices = []
+        weights = []
+        for i, code in enumerate(codes):
+            stn = graph.stations[code]
+            coords[i] = stn.coords
+            for ngb, weight in stn.connections.items():
+                indices.append(index[ngb])
+                weights.append(weight)
+            indptr[i + 1] = len(indices)
+        return cls(codes, coords, indptr, indices, weights)
+
+    # creates the view from arrays of connections frm[e] -> to[e] with distance weights[e]
+    @classmethod
+    def from_edges(cls, codes, coords, frm, to, weights):
+        frm = np.asarray(frm)
+        order = np.argsort(frm, kind="stable")
+        indptr = np.zeros(len(codes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(frm, minlength=len(codes)))
+        return cls(codes, coords, indptr, np.asarray(to)[order], np.asarray(weights)[order])
+
+    def __len__(self):
+        return len(self.codes)
+
+    # printing csr graph would be "CSRGraph(<stations> stations, <connections> connections)"
+    def __str__(self):
+        return "CSRGraph(" + str(len(self.codes)) + " stations, " + str(len(self.indices)) + " connections)"
+
+    # returns index of station code
+    def get_index(self, code):
+        if code not in self.index:
+            raise ValueError("station code not found")
+        return self.index[code]
+
+    # returns station code of index
+    def get_code(self, i):
+        return self.codes[i]
+
+    # returns (neighbour indices, distances) arrays of station index i
+    def get_connections(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]], self.weights[self.indptr[i]:self.indptr[i + 1]]
+
+    # returns number of bytes used by the numpy arrays
+    def nbytes(self):
+        return self.coords.nbytes + self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes
+
+    # returns CSRGraph with every connection flipped, so incoming connections of station i are
+    # its neighbours in the reversed graph. one sided connections stay one sided.
+    def reverse(self):
+        if self.reversed is None:
+            rows = np.repeat(np.arange(len(self.codes)), np.diff(self.indptr))
+            self.reversed = CSRGraph.from_edges(self.codes, self.coords, self.indices, rows, self.weights)
+            self.reversed.reversed = self
+        return self.reversed
+
+    # returns checksum of the arrays, used to check whether files cached from a graph are still valid
+    def get_checksum(self):
+        if self.checksum is None:
+            sha = hashlib.sha1()
+            sha.update("\n".join(self.codes).encode())
+            for arr in (self.indptr, self.indices, self.weights):
+                sha.update(arr.tobytes())
+            self.checksum = sha.hexdigest()
+        return self.checksum
+
+
+class PathMatrix:
+
+    # all pairs shortest paths of a CSRGraph. dist[i][j] is the distance from station index i to j,
+    # next_hop[i][j] is the station after i on the shortest path to j (-1 if j can't be reached)
+    def __init__(self, codes, dist, next_hop, checksum):
+        self.codes = list(codes)
+        self.dist = dist
+        self.next_hop = next_hop
+        self.checksum = checksum
+
+    # bytes the matrices of n stations would take in memory
+    @staticmethod
+    def footprint(n):
+        return n * n * (np.dtype(np.float32).itemsize + np.dtype(PathMatrix.hop_dtype(n)).itemsize)
+
+    # smallest integer type that can hold station indices and -1
+    @staticmethod
+    def hop_dtype(n):
+        return np.int16 if n < np.iinfo(np.int16).max else np.int32
+
+    # builds the matrices with vectorised floyd warshall, one numpy pass per intermediate station
+    @classmethod
+    def build(cls, csr):
+        n = len(csr)
+        dist = np.full((n, n), np.inf)
+        next_hop = np.full((n, n), -1, dtype=cls.hop_dtype(n))
+        rows = np.repeat(np.arange(n), np.diff(csr.indptr))
+        # np.minimum.at keeps the shortest of repeated connections
+        np.minimum.at(dist, (rows, csr.indices), csr.weights)
+        has_edge = np.isfinite(dist)
+        next_hop[has_edge] = np.broadcast_to(np.arange(n), (n, n))[has_edge]
+        np.fill_diagonal(dist, 0)
+        np.fill_diagonal(next_hop, np.arange(n))
+
+        for k in range(n):
+            alt = dist[:, k, None] + dist[k, None, :]
+            better = alt < dist
+            np.copyto(dist, alt, where=better)
+            np.copyto(next_hop, np.broadcast_to(next_hop[:, k, None], (n, n)), where=better)
+
+        dist[np.isinf(dist)] = UNREACHED
+        return cls(csr.codes, dist.astype(np.float32), next_hop, csr.get_checksum())
+
+    # saves matrices into a binary .npz file
+    def save(self, path):
+        SaveAtomic(path, lambda f: np.savez(f, codes=np.array(self.codes), dist=self.dist, next_hop=self.next_hop,
+                                            checksum=np.array(self.checksum)))
+
+    # loads matrices saved with save()
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(f["codes"].tolist(), f["dist"], f["next_hop"], str(f["checksum"]))
+
+    # returns number of bytes used by the matrices
+    def nbytes(self):
+        return self.dist.nbytes + self.next_hop.nbytes
+
+    # returns list of station indices from src to dest by following next hops, empty if not reachable
+    def get_path(self, src, dest):
+        if self.next_hop[src, dest] == -1:
+            return []
+        path = [src, ]
+        while src != dest:
+            src = int(self.next_hop[src, dest])
+            path.append(src)
+        return path
+
+    # printing path matrix would be "PathMatrix(<n> stations, <x> MB, dist <type>, next hop <type>)"
+    def __str__(self):
+        return ("PathMatrix(" + str(len(self.codes)) + " stations, " + str(round(self.nbytes() / 2**20, 2)) + " MB, dist "
+                + str(self.dist.dtype) + ", next hop " + str(self.next_hop.dtype) + ")")
+
+
+class RouteCache:
+
+    # bounded least recently used cache of findPath results, safe to share between threads.
+    # paths = {(<src>, <dest>, <method>): (<path tuple>, <found>)}, trees = {<src index>: (<dist>, <prev>)}
+    # everything is dropped once the graph version it was computed on changes.
+    def __init__(self, maxsize = ROUTE_CACHE_SIZE, maxtrees = TREE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.maxtrees = maxtrees
+        self.lock = threading.RLock()
+        self.paths = OrderedDict()
+        self.trees = OrderedDict()
+        self.version = None     # (id of graph, graph version) routes were computed on
+        self.hits = 0
+        self.misses = 0
+        self.tree_hits = 0
+        self.evictions = 0
+
+    # printing cache would be "RouteCache(<stats>)"
+    def __str__(self):
+        return "RouteCache(" + str(self.stats()) + ")"
+
+    # drops all routes if graph changed since they were cached
+    def check_version(self, graph):
+        with self.lock:
+            if (id(graph), graph.version) != self.version:
+                self.paths.clear()
+                self.trees.clear()
+                self.version = (id(graph), graph.version)
+
+    # returns (path, found) of src to dest found by method, None if not cached.
+    # methods can pick different paths of equal length, so each keeps its own
+    def get_path(self, src, dest, method = ROUTING_METHOD):
+        with self.lock:
+            key = (src, dest, method)
+            if key not in self.paths:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.paths.move_to_end(key)
+            path, found = self.paths[key]
+            return list(path), found
+
+    # remembers (path, found) of src to dest found by method, evicting least recently used route if full
+    def put_path(self, src, dest, path, found, method = ROUTING_METHOD):
+        with self.lock:
+            key = (src, dest, method)
+            self.paths[key] = (tuple(path), found)
+            self.paths.move_to_end(key)
+            while len(self.paths) > self.maxsize:
+                self.paths.popitem(last=False)
+                self.evictions += 1
+
+    # returns (dist, prev) arrays of whole graph from station index src, None if not cached
+    def get_tree(self, src):
+        with self.lock:
+            if src not in self.trees:
+                return None
+            self.tree_hits += 1
+            self.trees.move_to_end(src)
+            return self.trees[src]
+
+    # remembers (dist, prev) arrays from station index src
+    def put_tree(self, src, dist, prev):
+        with self.lock:
+            self.trees[src] = (dist, prev)
+            self.trees.move_to_end(src)
+            while len(self.trees) > self.maxtrees:
+                self.trees.popitem(last=False)
+                self.evictions += 1
+
+    # returns dictionary of counters
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "tree_hits": self.tree_hits,
+                    "evictions": self.evictions, "paths": len(self.paths), "trees": len(self.trees)}
+
+    # forgets all routes
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
+            self.trees.clear()
+
+
+class StationRegistry:
+
+    # constant time lookups of station details, built once from the station dataframe.
+    # index = {<code>: <row>}, zipcodes/addresses = {<value>: [<codes in row order>]},
+    # pixels = {<map key>: <array of shape (n, 2)>}, pixel_lookup = {<map key>: {<code>: [x, y]}},
+    # fuzzy = {<column>: <FuzzyIndex over column in row order>}, made on first use
+    def __init__(self, data):
+        self.codes = data["code"].tolist()
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.coords = data[["Latitude", "Longitude"]].to_numpy(dtype=np.float64)
+        self.coords_list = self.coords.tolist()
+        self.zips = data["zipcode"].tolist()
+        self.cities = data["city"].tolist()
+        self.states = data["state"].tolist()
+        self.zipcodes = self.reverse_map(self.zips)
+        self.columns = {column: data[column].tolist() for column in ("Full_Address", "address1", "address2")}
+        self.columns["city"] = self.cities
+        self.addresses = {column: self.reverse_map(self.columns[column]) for column in ("Full_Address", "address1", "address2")}
+        self.pixels = {}
+        self.pixel_lookup = {}
+        self.fuzzy = {}
+
+    # returns {<value>: [<codes with that value in row order>]}, missing values are skipped
+    def reverse_map(self, values):
+        result = {}
+        for code, value in zip(self.codes, values):
+            if isinstance(value, str):
+                result.setdefault(value, []).append(code)
+        return result
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    # returns [latitude, longitude] of station code
+    def get_coords(self, code):
+        return self.coords_list[self.index[code]]
+
+    # returns zipcode of station code
+    def get_zipcode(self, code):
+        return self.zips[self.index[code]]
+
+    # returns city of station code
+    def get_city(self, code):
+        return self.cities[self.index[code]]
+
+    # returns state of station code
+    def get_state(self, code):
+        return self.states[self.index[code]]
+
+    # returns first code in codes_ that is one of stations (a filtered station dataframe), None if there is none
+    def first_of(self, codes_, stations = None):
+        if stations is not None and len(stations) != len(self.codes):
+            allowed = set(stations["code"])
+            codes_ = [code for code in codes_ if code in allowed]
+        return codes_[0] if len(codes_) != 0 else None
+
+    # returns code of first station with zipcode, only looking at stations if given
+    def code_for_zipcode(self, zipcode, stations = None):
+        return self.first_of(self.zipcodes.get(zipcode, []), stations)
+
+    # returns code of first station whose column ("Full_Address", "address1" or "address2") is address
+    def code_for_address(self, address, column = "Full_Address", stations = None):
+        return self.first_of(self.addresses[column].get(address, []), stations)
 
-def Dijkstra(src, dest):
+    # returns FuzzyIndex over column ("Full_Address", "address1", "address2" or "city") of all stations
+    def get_fuzzy(self, column):
+        if column not in self.fuzzy:
+            self.fuzzy[column] = FuzzyIndex(self.columns[column])
+        return self.fuzzy[column]
+
+    # returns array of rows of stations (a filtered station dataframe), None if it's all of them
+    def rows_of(self, stations = None):
+        if stations is None or len(stations) == len(self.codes):
+            return None
+        return np.array([self.index[code] for code in stations["code"]], dtype=np.int64)
+
+    # returns close matches of word in column of stations, same as difflib.get_close_matches on list(stations[column])
+    def close_matches(self, word, column, cutoff = 0.6, stations = None):
+        return self.get_fuzzy(column).get_close_matches(word, cutoff = cutoff, rows = self.rows_of(stations))
+
+    # returns array of shape (n, 2) of station pixels in row order. project(latitudes, longitudes)
+    # gives (xs, ys) arrays, it's only called the first time key is seen
+    def get_pixels(self, key, project):
+        if key not in self.pixels:
+            xs, ys = project(self.coords[:, 0], self.coords[:, 1])
+            pixels = np.column_stack((xs, ys))
+            self.pixel_lookup[key] = dict(zip(self.codes, pixels.tolist()))
+            self.pixels[key] = pixels
+        return self.pixels[key]
+
+    # returns [x, y] pixel of station code on map key, after get_pixels(key, ...)
+    def get_pixel(self, code, key):
+        return self.pixel_lookup[key][code]
+
+
+class Dataset:
+
+    # stations and graph of one data folder, loaded on first use from the binary snapshot in
+    # cache_path, or from the csv files if the snapshot is missing or older than them.
+    # dataset.data is the station dataframe, dataset.graph the Graph built from it.
+    # timings = {<loading step>: <secs>} of the last load
+    def __init__(self, data_path = dir_path, validate = True, snapshot = True):
+        self.lock = threading.RLock()
+        self.validate = validate
+        self.snapshot = snapshot
+        self.set_path(data_path)
+
+    # points dataset to another data folder, it's loaded again on next use
+    def set_path(self, data_path):
+        with self.lock:
+            self.data_path = data_path
+            self.files = (os.path.join(data_path, "train_data.csv"), os.path.join(data_path, "train_connections.csv"))
+            self.cache_path = os.path.join(data_path, "cache")
+            self.snapshot_file = os.path.join(self.cache_path, "snapshot.npz")
+            self.train_data = None
+            self.train_graph = None
+            self.geo_index = None
+            self.registry = None
+            self.hash = None
+            self.timings = {}
+
+    # loads snapshot, or csv files building and validating the graph and saving a new snapshot.
+    # does nothing if already loaded
+    def load(self, verbose = 0):
+        with self.lock:
+            if self.train_graph is not None:
+                return self
+            self.timings = {}
+            t = time.time()
+            checksum = self.get_hash()
+            self.timings["hashing"] = time.time() - t
+
+            #snapshot was validated when it was saved
+            if self.snapshot:
+                def read(path):
+                    t = time.time()
+                    try:
+                        return LoadSnapshot(path, checksum)
+                    finally:
+                        self.timings["snapshot"] = time.time() - t
+
+                def save(result, path):
+                    t = time.time()
+                    SaveSnapshot(path, result[0], result[1], checksum)
+                    self.timings["saving snapshot"] = time.time() - t
+
+                (self.train_data, self.train_graph), loaded = LoadOrBuild(self.snapshot_file, read, self.read_csv, save)
+            else:
+                self.train_data, self.train_graph = self.read_csv()
+            if verbose: print(self.report())
+            return self
+
+    # returns (data, graph) loaded from the csv files, validated if validate is set
+    def read_csv(self):
+        t = time.time()
+        data, graph = DataLoading(*self.files)
+        self.timings["loading"] = time.time() - t
+        if self.validate:
+            t = time.time()
+            Validity(data, graph)
+            self.timings["validity"] = time.time() - t
+        return data, graph
+
+    # returns true if csv files have been loaded
+    def is_loaded(self):
+        return self.train_graph is not None
+
+    # station dataframe, loaded on first use
+    @property
+    def data(self):
+        if self.train_data is None:
+            self.load()
+        return self.train_data
+
+    # station graph, loaded on first use
+    @property
+    def graph(self):
+        if self.train_graph is None:
+            self.load()
+        return self.train_graph
+
+    # returns StationRegistry of station details, built on first use
+    def get_registry(self):
+        with self.lock:
+            if self.registry is None:
+                self.registry = StationRegistry(self.data)
+            return self.registry
+
+    # returns GeoIndex over coordinates of stations, in the row order of data
+    def get_geo_index(self):
+        with self.lock:
+            if self.geo_index is None:
+                self.geo_index = GeoIndex(self.data[["Latitude", "Longitude"]].to_numpy(), EARTH_RADIUS)
+            return self.geo_index
+
+    # returns hash of the data files, key of files cached from them
+    def get_hash(self):
+        if self.hash is None:
+            self.hash = DataHash(*self.files)
+        return self.hash
+
+    # returns string with time spent on each loading step
+    def report(self):
+        if not self.is_loaded():
+            return "dataset at " + self.data_path + " not loaded yet"
+        result = "loaded " + str(self.train_graph.num_stations) + " stations from " + self.data_path + " in "
+        result += str(round(sum(self.timings.values()), 4)) + " secs ("
+        result += ", ".join(step + " " + str(round(secs, 4)) + " secs" for step, secs in self.timings.items()) + ")"
+        return result
+
+
+# stations and graph used by the program, nothing is read until first use
+dataset_ = Dataset()
+path_matrix_ = None
+route_cache_ = RouteCache()
+
+def Dijkstra(src, dest = None):
     '''
     input:  [string, station code] src, [string, station code] dest, 
             [Graph Object] graph
     output: [Dictionary of distance frm src] dist, [Dictionary of prev nodes] prev
     Finds shortest path between two stations and outputs a list of stations in order
+    Uses a binary heap with lazy deletion: stale queue entries are skipped when popped
+    instead of being searched for and re-sorted. Stops as soon as dest is settled,
+    pass dest = None to settle the whole graph.
     '''
 
-    dist = {}
-    prev = {}
-    dist[src] = 0 
-    visited = set()
-    Q = []
+    graph = dataset_.graph
 
     #populating intialising value
-    for v in graph_.stations:
-        if v != src:
-            dist[v] = 1000000        
-            prev[v] = "ABC"       
-        Q.append((dist[v], v))
-        Q.sort(reverse=True)
-    
+    dist = dict.fromkeys(graph.stations, UNREACHED)
+    prev = dict.fromkeys(graph.stations, NO_PREV)
+    dist[src] = 0
+    prev.pop(src, None)
+    visited = set()
+    Q = [(0, src)]
+
     #running dijkstra.
     while len(Q) != 0:
-        u = Q.pop()[1]
-        visited.add(u)        
-        for v in graph_[u].connections:
+        d, u = heapq.heappop(Q)
+        if u in visited:
+            continue
+        visited.add(u)
+        if u == dest:
+            break
+        for v, weight in graph[u].connections.items():
             if v in visited:
                 continue
-            alt = dist[u] + graph_[u][v]
-            temp = dist[v]
+            alt = d + weight
             if alt < dist[v]:
                 dist[v] = alt
                 prev[v] = u
-                Q[Q.index((temp, v))] = (alt, v)
-                Q.sort(reverse=True)
+                heapq.heappush(Q, (alt, v))
 
     return dist, prev
 
 
 
-def findPath(src, dest):
+def DijkstraCSR(src, dest = -1, csr = None, stats = None):
+    '''
+    input:  [int, station index] src, [int, station index] dest, 
+            [CSRGraph Object] csr (defaults to dataset_.graph.get_csr()), [dict] stats
+    output: [array of distance frm src] dist, [array of prev station indices] prev
+    Same search as Dijkstra on the integer indexed CSR view. Unreached stations have
+    dist = UNREACHED and prev = -1. Stops as soon as dest is settled, dest = -1 settles all.
+    If stats is given, stats["expanded"] is set to the number of settled stations.
+    '''
+
+    if csr is None:
+        csr = dataset_.graph.get_csr()
+    indptr = csr.indptr_list
+    indices = csr.indices_list
+    weights = csr.weights_list
+
+    #populating intialising value
+    dist = [UNREACHED] * len(csr)
+    prev = [-1] * len(csr)
+    visited = [False] * len(csr)
+    dist[src] = 0
+    Q = [(0, src)]
+    expanded = 0
+
+    #running dijkstra.
+    while len(Q) != 0:
+        d, u = heapq.heappop(Q)
+        if visited[u]:
+            continue
+        visited[u] = True
+        expanded += 1
+        if u == dest:
+            break
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if visited[v]:
+                continue
+            alt = d + weights[k]
+            if alt < dist[v]:
+                dist[v] = alt
+                prev[v] = u
+                heapq.heappush(Q, (alt, v))
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return np.array(dist, dtype=np.float64), np.array(prev, dtype=np.int32)
+
+
+def AStar(src, dest, csr = None, stats = None):
+    '''
+    input:  [int, station index] src, [int, station index] dest, 
+            [CSRGraph Object] csr (defaults to dataset_.graph.get_csr()), [dict] stats
+    output: [array of distance frm src] dist, [array of prev station indices] prev
+    A* search on the CSR view. Great circle distance to dest is the heuristic, connections
+    are weighted with the same Distance so it never overestimates and stations are settled
+    in order of dist + heuristic, which heads the search towards dest.
+    If stats is given, stats["expanded"] is set to the number of settled stations.
+    '''
+
+    if csr is None:
+        csr = dataset_.graph.get_csr()
+    indptr = csr.indptr_list
+    indices = csr.indices_list
+    weights = csr.weights_list
+
+    #heuristic of every station at once
+    h = DistanceBatch(csr.coords, csr.coords[dest]).tolist()
+
+    #populating intialising value
+    dist = [UNREACHED] * len(csr)
+    prev = [-1] * len(csr)
+    visited = [False] * len(csr)
+    dist[src] = 0
+    Q = [(h[src], src)]
+    expanded = 0
+
+    #running A*.
+    while len(Q) != 0:
+        u = heapq.heappop(Q)[1]
+        if visited[u]:
+            continue
+        visited[u] = True
+        expanded += 1
+        if u == dest:
+            break
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if visited[v]:
+                continue
+            alt = dist[u] + weights[k]
+            if alt < dist[v]:
+                dist[v] = alt
+                prev[v] = u
+                heapq.heappush(Q, (alt + h[v], v))
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    return np.array(dist, dtype=np.float64), np.array(prev, dtype=np.int32)
+
+
+def BidirectionalDijkstra(src, dest, csr = None, stats = None):
+    '''
+    input:  [int, station index] src, [int, station index] dest, 
+            [CSRGraph Object] csr (defaults to dataset_.graph.get_csr()), [dict] stats
+    output: [float] distance from src to dest (UNREACHED if not reachable), [list of station indices] path
+    Searches forward from src over outgoing connections and backward from dest over incoming
+    connections (csr.reverse()), always growing the side with the closer queue top. Stops once
+    the two queue tops together are no shorter than the best meeting point found.
+    If stats is given, stats["expanded"] is set to the number of settled stations of both sides.
+    '''
+
+    if csr is None:
+        csr = dataset_.graph.get_csr()
+    if src == dest:
+        if stats is not None:
+            stats["expanded"] = 1
+        return 0, [src, ]
+    sides = (csr, csr.reverse())
+    dist = ([UNREACHED] * len(csr), [UNREACHED] * len(csr))
+    prev = ([-1] * len(csr), [-1] * len(csr))
+    visited = ([False] * len(csr), [False] * len(csr))
+    dist[0][src] = 0
+    dist[1][dest] = 0
+    Q = ([(0, src)], [(0, dest)])
+    best = UNREACHED
+    meet = -1
+    expanded = 0
+
+    #running both searches.
+    while len(Q[0]) != 0 and len(Q[1]) != 0:
+        if Q[0][0][0] + Q[1][0][0] >= best:
+            break
+        side = 0 if Q[0][0][0] <= Q[1][0][0] else 1
+        d, u = heapq.heappop(Q[side])
+        if visited[side][u]:
+            continue
+        visited[side][u] = True
+        expanded += 1
+        graph = sides[side]
+        other_dist = dist[1 - side]
+        for k in range(graph.indptr_list[u], graph.indptr_list[u + 1]):
+            v = graph.indices_list[k]
+            if visited[side][v]:
+                continue
+            alt = d + graph.weights_list[k]
+            if alt < dist[side][v]:
+                dist[side][v] = alt
+                prev[side][v] = u
+                heapq.heappush(Q[side], (alt, v))
+            #checking whether the other side already reached v
+            if alt + other_dist[v] < best:
+                best = alt + other_dist[v]
+                meet = v
+
+    if stats is not None:
+        stats["expanded"] = expanded
+    if meet == -1:
+        return UNREACHED, []
+
+    #joining forward path up to meeting station with backward path after it
+    path = BacktrackIndices(prev[0], src, meet)
+    curr = meet
+    while curr != dest:
+        curr = prev[1][curr]
+        path.append(curr)
+    return best, path
+
+
+def CompareSearch(src, dest, verbose = 1):
+    '''
+    input:  [string, station code] src, [string, station code] dest
+    output: [dict] {<method>: {"expanded": <settled stations>, "time": <secs>, "dist": <miles>}}
+    Runs DijkstraCSR, AStar and BidirectionalDijkstra between two stations and reports how much
+    of the graph each explored.
+    '''
+
+    csr = dataset_.graph.get_csr()
+    src_idx, dest_idx = csr.get_index(src), csr.get_index(dest)
+    result = {}
+    for name, search in (("dijkstra", DijkstraCSR), ("astar", AStar), ("bidirectional", BidirectionalDijkstra)):
+        stats = {}
+        t = time.time()
+        dist, prev = search(src_idx, dest_idx, csr, stats)
+        stats["time"] = time.time() - t
+        stats["dist"] = float(dist) if name == "bidirectional" else float(dist[dest_idx])
+        result[name] = stats
+        if verbose:
+            print(name, "expanded", stats["expanded"], "of", len(csr), "stations in",
+                  round(stats["time"] * 1000, 3), "ms,", round(stats["dist"], 1), "miles")
+    return result
+
+
+def BacktrackIndices(prev, src, dest):
+    '''
+    input:  [array of prev station indices] prev, [int] src, [int] dest
+    output: [list of station indices] path from src to dest, empty if dest was not reached
+    '''
+
+    path = [dest, ]
+    curr = dest
+    while curr != src and curr != -1:
+        curr = int(prev[curr])
+        path.append(curr)
+    if curr == -1:
+        return []
+    return path[::-1]
+
+
+def GetPathMatrix(verbose = 0):
+    '''
+    output: [PathMatrix Object] all pairs matrix of dataset_.graph, None if it would be bigger than APSP_MAX_BYTES
+    Loads the matrix from the cache folder, keyed by hash of the data files, or builds
+    and saves it the first time. It's kept in memory afterwards.
+    '''
+
+    global path_matrix_
+    csr = dataset_.graph.get_csr()
+    checksum = csr.get_checksum()
+    if path_matrix_ is not None and path_matrix_.checksum == checksum:
+        return path_matrix_
+
+    #too big to hold, callers search on demand
+    needed = PathMatrix.footprint(len(csr))
+    if needed > APSP_MAX_BYTES:
+        if verbose: print("path matrix would need", round(needed / 2**20, 2), "MB, searching on demand")
+        return None
+
+    #loading saved matrix if it was built from same graph
+    filename = os.path.join(dataset_.cache_path, "apsp_" + dataset_.get_hash() + ".npz")
+    t = time.time()
+    path_matrix_, loaded = LoadOrBuild(filename, PathMatrix.load, lambda: PathMatrix.build(csr), PathMatrix.save, checksum)
+    if verbose and loaded:
+        print("loaded", path_matrix_, "from", filename)
+    elif verbose:
+        print("built", path_matrix_, "in", round(time.time() - t, 3), "secs,",
+              round(os.path.getsize(filename) / 2**20, 2), "MB on disk")
+    return path_matrix_
+
+
+def findPath(src, dest, method = ROUTING_METHOD, cache = True):
     '''
     input:  [string, station code] src, [string, station code] dest, 
+            [string] method, one of ROUTING_METHODS, [bool] cache
     output: [list or array] Path, [bool] true if path found
     Finds shortest path between two stations and outputs a list of stations in order
-    USes Dijkstra function.
+    USes Dijkstra function. With cache, repeated routes and routes from an
+    already searched source come from route_cache_ instead of a new search,
+    routes are cached per method so each method always gives its own path.
+    '''
+
+    if method not in ROUTING_METHODS:
+        raise ValueError("method should be one of " + str(ROUTING_METHODS))
+    if not cache:
+        return SearchPath(src, dest, method)
+
+    route_cache_.check_version(dataset_.graph)
+    result = route_cache_.get_path(src, dest, method)
+    if result is not None:
+        return result
+    path, found = SearchPath(src, dest, method, route_cache_)
+    route_cache_.put_path(src, dest, path, found, method)
+    return path, found
+
+
+def SearchPath(src, dest, method, cache = None):
+    '''
+    input:  [string, station code] src, [string, station code] dest, 
+            [string] method, one of ROUTING_METHODS, [RouteCache Object] cache
+    output: [list or array] Path, [bool] true if path found
+    Runs the search of findPath. If cache is given, the csr method settles the whole
+    graph from src once and keeps the tree in cache for later queries from src.
     '''
 
+    #walking precomputed next hops, searching on demand if there's no matrix
+    if method == "apsp":
+        matrix = GetPathMatrix()
+        if matrix is not None:
+            csr = dataset_.graph.get_csr()
+            path = matrix.get_path(csr.get_index(src), csr.get_index(dest))
+            if len(path) == 0:
+                return [], 0
+            return [csr.codes[i] for i in path], 1
+        method = "csr"
+
+    #finding path using A* towards dest
+    if method == "astar":
+        csr = dataset_.graph.get_csr()
+        src_idx, dest_idx = csr.get_index(src), csr.get_index(dest)
+        dist, prev = AStar(src_idx, dest_idx, csr)
+        path = BacktrackIndices(prev, src_idx, dest_idx)
+        if len(path) == 0:
+            return [], 0
+        return [csr.codes[i] for i in path], 1
+
+    #finding path in the contraction hierarchy
+    if method == "ch":
+        from hierarchy import GetHierarchy
+        index = GetHierarchy()
+        dist, path = index.query(index.index[src], index.index[dest])
+        if len(path) == 0:
+            return [], 0
+        return [index.codes[i] for i in path], 1
+
+    #finding path by searching from both ends
+    if method == "bidirectional":
+        csr = dataset_.graph.get_csr()
+        dist, path = BidirectionalDijkstra(csr.get_index(src), csr.get_index(dest), csr)
+        if len(path) == 0:
+            return [], 0
+        return [csr.codes[i] for i in path], 1
+
+    #finding path using dijkstra on integer indexed graph
+    if method == "csr":
+        csr = dataset_.graph.get_csr()
+        src_idx, dest_idx = csr.get_index(src), csr.get_index(dest)
+        if cache is None:
+            dist, prev = DijkstraCSR(src_idx, dest_idx, csr)
+        else:
+            tree = cache.get_tree(src_idx)
+            if tree is None:
+                tree = DijkstraCSR(src_idx, -1, csr)
+                cache.put_tree(src_idx, *tree)
+            dist, prev = tree
+        path = BacktrackIndices(prev, src_idx, dest_idx)
+        if len(path) == 0:
+            return [], 0
+        return [csr.codes[i] for i in path], 1
+
     #finding path using dijkstra
     dist, prev = Dijkstra(src, dest)
     path = [dest, ]
     curr = dest
     
     #finding path by backtracking
-    while curr != src and curr != "ABC":
+    while curr != src and curr != NO_PREV:
         curr = prev[curr]
         path.append(curr)
-    if curr == "ABC":
+    if curr == NO_PREV:
         return [], 0
     
     #return the path
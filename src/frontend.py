@@ -12,27 +12,31 @@ from geopy.geocoders import Nominatim
 import numpy as np
 
 import backend
-import difflib
+import os
+from geocache import GeocodeCache, RemoteGeocoder
+from gazetteer import GetGazetteer, GetStationZips, BenchmarkGazetteer
+from fuzzy import FuzzyIndex
 import re
 from util import abbrev_to_us_state, us_state_to_abbrev, Assert, common_words
 import util
 import pgeocode
-import math
 import matplotlib.pyplot as plt
 import time
 
 #gets detail about us zipcodes
 nomi = pgeocode.Nominatim('us')
-#getting distance between stations
-dist = pgeocode.GeoDistance('us')
 #find geolocator
 geolocator = Nominatim(user_agent="geoapiExercises")
-
-data_ = backend.data_
-graph_ = backend.graph_
+#geolocator answers cached on disk, made on first use
+geocode_cache_ = None
+#value of USE_GAZETTEER when geocode_cache_ was made, it's made again once the flag changes
+geocode_uses_gazetteer_ = None
+#fuzzy index of state names
+states_index_ = FuzzyIndex(us_state_to_abbrev.keys())
 
 WIDTH = 20
 HEIGHT = 20
+USE_GAZETTEER = False   # resolves places with the local gazetteer instead of geolocator, no network needed
 
 def FindStation(data, nearby = True, thread_ = []):
     '''
@@ -58,6 +62,29 @@ def FindStation(data, nearby = True, thread_ = []):
     thread_.append(code)
     return code
 
+def GetGeocoder():
+    '''
+    output: [GeocodeCache Object] cache in front of geolocator, saved in the data cache folder
+            (or in front of the local gazetteer, kept in memory, if USE_GAZETTEER)
+    changing USE_GAZETTEER takes effect on the next call, a geocoder given to SetGeocoder is kept until then
+    '''
+    if geocode_cache_ is None or geocode_uses_gazetteer_ != USE_GAZETTEER:
+        if USE_GAZETTEER:
+            return SetGeocoder(GetGazetteer(nomi))
+        path = os.path.join(backend.dataset_.cache_path, "geocode.sqlite")
+        SetGeocoder(RemoteGeocoder(geolocator), path)
+    return geocode_cache_
+
+def SetGeocoder(geocoder, path = ":memory:"):
+    '''
+    input:  geocoder(query) returning (latitude, longitude) or None, like geocache.LocalGeocoder, path of its cache
+    Makes FindStationBasic use geocoder instead of geolocator, the cache is kept in memory by default
+    '''
+    global geocode_cache_, geocode_uses_gazetteer_
+    geocode_cache_ = GeocodeCache(path, geocoder)
+    geocode_uses_gazetteer_ = USE_GAZETTEER
+    return geocode_cache_
+
 def FindStationBasic(data, dist = 10):
     '''
     input: String
@@ -66,24 +93,14 @@ def FindStationBasic(data, dist = 10):
     It handles very simple ones using API
     '''
 
-    cords = geolocator.geocode(data + ", United States of America")
+    cords = GetGeocoder().geocode(data + ", United States of America")
     if (cords == None):
         return None
-    cords = cords[-1]
-    lats = list(data_["Latitude"])
-    longs = list(data_["Longitude"])
-    cords_ = []
-    for lat, long in zip(lats, longs):
-        cords_.append((lat, long))
-    optimal_cord = 0
-    max = dist
-    for cord in cords_:
-        distance = backend.Distance(cord, cords)
-        if distance < max:
-            optimal_cord = cord[0]
-            max = distance
-    if optimal_cord != 0:
-        return list(data_[data_["Latitude"] == optimal_cord]["code"])[0]   
+
+    #closest station from the spatial index, if it is within dist miles
+    miles, idx = backend.dataset_.get_geo_index().nearest(cords)
+    if len(idx) != 0 and miles[0] < dist:
+        return backend.dataset_.data["code"].iloc[idx[0]]
     return None
 
 def CheckFindStation(verbose = True):
@@ -145,11 +162,21 @@ def CheckFindStation(verbose = True):
     print(util.count, "assertions passed")
     print(round(util.avgtime, 4), "secs  per assertion")
     print(round(time.time() - t, 4), "secs", "for all assertions: ")
+    print(GetGeocoder())
     #depending on speed of connection less than a second querries
 
-def FindStationCommon(data, p = 0.8):
+def CheckGazetteer(verbose = True):
     '''
-    input:  [string] User enter string for station
+    Compares latency and answers of the local gazetteer with geolocator on place names of CheckFindStation
+    '''
+    queries = ["Rensselaer, NY", "Champaign, IL", "St paul MN", "Saint paul", "evanston", "Inver Grove Heights",
+               "Geraldine", "Madison, Wisconsin", "Miami", "Austin, Texas", "Kankakee", "Mattoon, IL", "61820", "68901"]
+    queries = [query + ", United States of America" for query in queries]
+    return BenchmarkGazetteer(GetGazetteer(nomi), RemoteGeocoder(geolocator), queries, verbose)
+
+def FindStationCommon(data, p = 0.8, stations = None):
+    '''
+    input:  [string] User enter string for station, [dataframe] stations to search (all by default)
     - finds the station
         - if (data == zipcode), mark that station
         - if (data == one of the station code), mark that station
@@ -157,12 +184,14 @@ def FindStationCommon(data, p = 0.8):
     returns the valid station code associated with the user enter data
     this function checks for most of the common user entered data
     '''
-    valid_zipcode, zipcode = CheckZipCode(data)
-    valid_code, station_code = CheckStationCode(data.upper())
+    if stations is None:
+        stations = backend.dataset_.data
+    valid_zipcode, zipcode = CheckZipCode(data, stations)
+    valid_code, station_code = CheckStationCode(data.upper(), stations)
     if (valid_zipcode):
         # since the data entered is a valid zipcode of a train station, we need to mark that train station on the map
         # Also, return the station code that is associated with this zipcode for use later
-        code = list((data_[data_["zipcode"] == zipcode])['code'])[0]
+        code = backend.dataset_.get_registry().code_for_zipcode(zipcode, stations)
         return code
     elif (valid_code):
         # since the data entered is a valid code of a train station, we need to mark that train station on the map
@@ -171,19 +200,20 @@ def FindStationCommon(data, p = 0.8):
     else:
         # This is the general case so we have to check if the user inputted data matches any of the address parts at all and return the closest match
         # if no match, return None
-        Full_Addresses, Addresses1, Addresses2 = GetAddresses()
-        matches = difflib.get_close_matches(data, Full_Addresses, cutoff = p)
-        matches1 = difflib.get_close_matches(data, Addresses1, cutoff = p)
-        matches2 = difflib.get_close_matches(data, Addresses2, cutoff=p)
+        # fuzzy indexes of the registry give same matches as difflib over GetAddresses(stations)
+        registry = backend.dataset_.get_registry()
+        matches = registry.close_matches(data, "Full_Address", p, stations)
+        matches1 = registry.close_matches(data, "address1", p, stations)
+        matches2 = registry.close_matches(data, "address2", p, stations)
         # now that the close matches are filled in, return the closest one (if one exists)
         if (len(matches) != 0):
-            code = list(data_[data_["Full_Address"] == matches[0]]["code"])[0]
+            code = registry.code_for_address(matches[0], "Full_Address", stations)
             return code
         elif (len(matches1) != 0):
-            code = list(data_[data_["address1"] == matches1[0]]["code"])[0]
+            code = registry.code_for_address(matches1[0], "address1", stations)
             return code
         elif (len(matches2) != 0):
-            code = list(data_[data_["address2"] == matches2[0]]["code"])[0]
+            code = registry.code_for_address(matches2[0], "address2", stations)
             return code
         else:
             return None
@@ -200,24 +230,23 @@ def FindStationInter(data):
     '''
 
     # closer_data is data frame of interest
-    global data_
+    stations = backend.dataset_.data
 
-    #closer_data will be limting data_ to potential matches based on more info
-    closer_data = data_.copy()
+    #closer_data will be limting stations to potential matches based on more info
+    closer_data = stations.copy()
 
     data = data.strip()
     data = re.split(", |,| ", data)
     
     # removing empty string
     data = [s for s in data if s != ""]
-    states = list(us_state_to_abbrev.keys())
 
     # how strict similarity has to be
     prob = 0.8
 
     # replaced explicit state names to their respective code
     for idx, i in enumerate(data):
-        closest_state = difflib.get_close_matches(i, states, cutoff=prob)
+        closest_state = states_index_.get_close_matches(i, cutoff=prob)
         if len(closest_state) != 0:
             closest_state = us_state_to_abbrev[closest_state[0]]
             data[idx] = closest_state
@@ -226,7 +255,7 @@ def FindStationInter(data):
             break
         #check if two words combined. States like New York.
         if (idx != len(data) - 1):
-            closest_state = difflib.get_close_matches((i + " " + data[idx+1]).capitalize(), states, cutoff=0.8)
+            closest_state = states_index_.get_close_matches((i + " " + data[idx+1]).capitalize(), cutoff=0.8)
             if len(closest_state) == 0:continue
             if len(closest_state[0].split()) == 1:continue
             closest_state = us_state_to_abbrev[closest_state[0]]
@@ -244,13 +273,13 @@ def FindStationInter(data):
             break
 
     # finding cities in dataframe if there is any in user input
-    cities = list(closer_data["city"])
+    registry = backend.dataset_.get_registry()
     for idx, j in enumerate(data):
         if j.lower() in common_words:
             continue
-        closest_city = difflib.get_close_matches(j, cities, cutoff=prob)
+        closest_city = registry.close_matches(j, "city", prob, closer_data)
         if (idx != len(data) - 1 and len(closest_city) == 0):
-            closest_city = difflib.get_close_matches(j + " " + data[idx+1], cities, cutoff=0.63)
+            closest_city = registry.close_matches(j + " " + data[idx+1], "city", 0.63, closer_data)
         if (len(closest_city) != 0):
             closest_city = closest_city[0]
             if len(closest_city.split()) > 1:
@@ -267,23 +296,10 @@ def FindStationInter(data):
     s = ""
     for i in data: 
         s += i + " "
-    stored_data = data_.copy()
-    data_ = closer_data
-    code = FindStationCommon(s, 0.6)
-    data_ = stored_data
+    code = FindStationCommon(s, 0.6, closer_data)
     if (code != None):
         return code
 
-    #get all zipcodes of amtrak stations
-    zips = []
-    for i in GetZipcodes():
-        try:
-            zips.append(int(i))
-        except:
-            continue
-    zips = np.array(zips)
-    
-
     #finding if there is any potential zip code in user data
     main_zip = -1
     for potential in data:
@@ -294,61 +310,51 @@ def FindStationInter(data):
                 continue
             main_zip = potential
 
-    #if there is zip
+    #if there is zip, station with the closest zipcode centroid within 200 kms,
+    #else just find whichever is closest abs distance from zipcode
     if (main_zip != -1):
-
-        #checking if it's under certain distance
-        within_proximity = abs(zips - int(main_zip)) < 1000
-        zips = zips[within_proximity]
-        distances = []
-        station_zip = []
-
-        #looping over each potential zipcode and checking it's distance from zipcode in user
-        for zip_ in zips:
-            temp_dist = dist.query_postal_code(str(zip_), main_zip) 
-            if not (math.isnan(temp_dist)) and temp_dist < 200:
-                distances.append(temp_dist)
-                station_zip.append(str(zip_))
-
-        #if there are few zip codes, withing 200 kms of user entered zip code,
-        if (len(distances) != 0):
-            idx = np.argmin(distances)
-            return list(data_[data_["zipcode"] == station_zip[idx]]["code"])[0]
-
-        #else just find whichever is closest abs distance from zipcode
-        else:
-            idx = np.argmin(np.abs(zips - int(main_zip)))
-            return list(data_[data_["zipcode"] == str(zips[idx])]["code"])[0]
+        station_zips = GetStationZips(nomi, backend.dataset_.get_registry())
+        code = station_zips.nearest(main_zip, 200)
+        if (code == None):
+            code = station_zips.closest_number(main_zip)
+        return code
             
     return None
 
 
 
-def GetZipcodes():
+def GetZipcodes(stations = None):
     '''
-    returns all of the zipcodes of train stations as a list of strings
+    returns all of the zipcodes of train stations (all stations by default) as a list of strings
     '''
-    return list(data_["zipcode"])
+    if stations is None:
+        stations = backend.dataset_.data
+    return list(stations["zipcode"])
 
 
-def GetStationCodes():
+def GetStationCodes(stations = None):
     '''
-    returns all of the station codes of train stations as a list
+    returns all of the station codes of train stations (all stations by default) as a list
     '''
-    return list(data_["code"])
+    if stations is None:
+        stations = backend.dataset_.data
+    return list(stations["code"])
 
 
-def GetAddresses():
+def GetAddresses(stations = None):
     '''
     returns a list of three lists: the full addresses, part 1 of the addresses, and part 2 of the addresses respectively
+    of train stations (all stations by default)
     '''
-    return (list(data_["Full_Address"]), list(data_["address1"]), list(data_[~data_["address2"].isna()]["address2"]))
+    if stations is None:
+        stations = backend.dataset_.data
+    return (list(stations["Full_Address"]), list(stations["address1"]), list(stations[~stations["address2"].isna()]["address2"]))
 
 
-def CheckZipCode(data):
+def CheckZipCode(data, stations = None):
     '''
     this function checks if the data is in the format of a zipcode (a 5 digit number)
-    input: data that is entered by the user
+    input: data that is entered by the user, [dataframe] stations to check (all by default)
     returns two things.  First, a boolean value of if the zipcode is valid or not (true if it is, false if it is not)
     Second, the actual zipcode assuming that it is valid
     '''
@@ -356,23 +362,24 @@ def CheckZipCode(data):
         test_zip = int(data)
     except:
         test_zip = -1
-    all_zipcodes = GetZipcodes()
-    if str(test_zip) in all_zipcodes:
+    #constant time lookup in the registry, then only the stations given are looked at
+    registry = backend.dataset_.get_registry()
+    if registry.code_for_zipcode(str(test_zip), stations) is not None:
         return True, str(test_zip)
     else:
         return False, "00000"
 
 
-def CheckStationCode(data):
+def CheckStationCode(data, stations = None):
     '''
     this function checks if the data is in the format of a station code (a valid 3 character string)
-    input: data that is entered by the user
+    input: data that is entered by the user, [dataframe] stations to check (all by default)
     returns two things.  First, a boolean value of if the station code is valid or not (true if it is, false if it is not)
     Second, the actual station code assuming that it is valid
     '''
     code = data
-    all_station_codes = GetStationCodes()
-    if code in all_station_codes:
+    registry = backend.dataset_.get_registry()
+    if code in registry and registry.first_of([code], stations) is not None:
         return True, code
     else:
         return False, "000"
@@ -0,0 +1,106 @@
+'''
+Fuzzy would be responsible
+- for indexing candidate strings (addresses, cities, states) once
+- for answering difflib.get_close_matches queries on them without comparing the query to every candidate
+'''
+
+import heapq
+import numpy as np
+from difflib import SequenceMatcher
+
+
+class FuzzyIndex:
+
+    # candidates with the character counts of each kept in a matrix, counts[i, alphabet[c]] = times c is in
+    # candidate i, and bit masks of where each character is, masks[i] = {<c>: <int with bit k set if candidate[k] == c>}.
+    # Candidates that aren't strings (missing values) are kept in place but never match.
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        valid = [isinstance(candidate, str) for candidate in self.candidates]
+        self.valid = np.array(valid, dtype=bool)
+        self.lengths = np.array([len(c) if v else 0 for c, v in zip(self.candidates, valid)], dtype=np.float64)
+
+        self.alphabet = {}
+        for candidate, v in zip(self.candidates, valid):
+            if v:
+                for c in candidate:
+                    self.alphabet.setdefault(c, len(self.alphabet))
+        self.counts = np.zeros((len(self.candidates), max(len(self.alphabet), 1)), dtype=np.int32)
+        self.masks = [{} for candidate in self.candidates]
+        for i, (candidate, v) in enumerate(zip(self.candidates, valid)):
+            if v:
+                for k, c in enumerate(candidate):
+                    self.counts[i, self.alphabet[c]] += 1
+                    self.masks[i][c] = self.masks[i].get(c, 0) | (1 << k)
+
+    def common_length(self, i, word):
+        '''
+        returns length of the longest common subsequence of candidate i and word, bit-parallel over the candidate.
+        SequenceMatcher's matching blocks are in order in both strings, so they never add up to more than this.
+        '''
+        masks = self.masks[i]
+        length = len(self.candidates[i])
+        full = (1 << length) - 1
+        v = full
+        for c in word:
+            u = v & masks.get(c, 0)
+            v = ((v + u) | (v - u)) & full
+        return length - bin(v).count("1")
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def get_close_matches(self, word, n = 3, cutoff = 0.6, rows = None):
+        '''
+        input:  [string] word, [int] max matches n, [float] cutoff, [array of ints] rows of candidates to look at (all by default)
+        output: [list of strings] same as difflib.get_close_matches(word, <candidates in rows>, n, cutoff)
+        real_quick_ratio and quick_ratio, upper bounds of ratio, are computed for all candidates at once from
+        lengths and character counts. Candidates passing both get a tighter bound from their longest common
+        subsequence with word, and those passing it are compared with SequenceMatcher, highest bound first,
+        until no other candidate can be among the n best.
+        '''
+        if not n > 0:
+            raise ValueError("n must be > 0: %r" % (n,))
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError("cutoff must be in [0.0, 1.0]: %r" % (cutoff,))
+        rows = np.flatnonzero(self.valid) if rows is None else np.asarray(rows, dtype=np.int64)[self.valid[rows]]
+
+        #character counts of word, characters no candidate has can't be matched
+        columns, word_counts = [], []
+        for c in set(word):
+            if c in self.alphabet:
+                columns.append(self.alphabet[c])
+                word_counts.append(word.count(c))
+
+        #both bounds in the same floating point operations as difflib
+        lengths = self.lengths[rows]
+        total = lengths + len(word)
+        real_quick = np.where(total != 0, 2.0 * np.minimum(lengths, len(word)) / np.maximum(total, 1), 1.0)
+        matches = np.minimum(self.counts[np.ix_(rows, columns)], word_counts).sum(axis=1) if len(columns) != 0 else 0
+        quick = np.where(total != 0, 2.0 * matches / np.maximum(total, 1), 1.0)
+        keep = (real_quick >= cutoff) & (quick >= cutoff)
+        rows, total = rows[keep].tolist(), total[keep].tolist()
+
+        #tighter bound from the longest common subsequence
+        bounds = [2.0 * self.common_length(i, word) / t for i, t in zip(rows, total)]
+        candidates = sorted(((bound, i) for bound, i in zip(bounds, rows) if bound >= cutoff), key=lambda x: -x[0])
+
+        #comparing candidates with the highest bound first, once n are found no candidate with a bound
+        #below the n-th best ratio can get in, so the rest is skipped
+        result = []     # min heap of the n best (ratio, candidate)
+        s = SequenceMatcher()
+        s.set_seq2(word)
+        for bound, i in candidates:
+            if len(result) == n and bound < result[0][0]:
+                break
+            s.set_seq1(self.candidates[i])
+            ratio = s.ratio()
+            if ratio >= cutoff:
+                if len(result) < n:
+                    heapq.heappush(result, (ratio, self.candidates[i]))
+                else:
+                    heapq.heappushpop(result, (ratio, self.candidates[i]))
+
+        # same ordering as difflib, best score first, ties by candidate
+        result = sorted(result, reverse=True)
+        return [x for score, x in result]
@@ -0,0 +1,216 @@
+'''
+Gazetteer would be responsible
+- for indexing US place names and zipcodes with their coordinates, from the GeoNames table pgeocode keeps
+- for resolving free text like "Inver Grove Heights" or "evanston, IL" to coordinates without a remote geocoder
+'''
+
+import re
+import time
+import numpy as np
+from backend import Distance
+from spatial import GeoIndex
+from util import us_state_to_abbrev
+
+#paramters
+COUNTRY_SUFFIXES = (", united states of america", " united states of america", ", usa", " usa", ", us")
+EARTH_RADIUS_KM = 6371.009    # same radius as pgeocode.GeoDistance, so distances between zipcodes are in its km
+ZIP_PROXIMITY = 1000    # how far apart zipcode numbers can be when their centroids aren't known
+
+gazetteer_ = None
+station_zips_ = None
+
+
+class Gazetteer:
+
+    # places = {<place name in lowercase>: [(<state code>, <latitude>, <longitude>, <zipcodes>)]} with centroid of
+    # the zipcodes of the place in each state, the state with most zipcodes first.
+    # zips = {<zipcode>: (<latitude>, <longitude>)}, states = {<state name or code in lowercase>: <state code>}
+    def __init__(self, table):
+        table = table.dropna(subset=["place_name", "latitude", "longitude"])
+        self.zips = dict(zip(table["postal_code"].astype(str).str.zfill(5),
+                             zip(table["latitude"].tolist(), table["longitude"].tolist())))
+
+        self.places = {}
+        grouped = table.assign(name = table["place_name"].str.lower().str.strip()).groupby(["name", "state_code"])
+        centroids = grouped[["latitude", "longitude"]].mean()
+        counts = grouped.size()
+        for (name, state), (latitude, longitude), count in zip(centroids.index, centroids.values.tolist(), counts.tolist()):
+            self.places.setdefault(name, []).append((state, latitude, longitude, count))
+        for entries in self.places.values():
+            entries.sort(key = lambda entry: -entry[3])
+
+        self.states = {name.lower(): code for name, code in us_state_to_abbrev.items()}
+        self.states.update({code.lower(): code for code in us_state_to_abbrev.values()})
+
+    # builds gazetteer from table of a pgeocode.Nominatim object
+    @classmethod
+    def from_pgeocode(cls, nomi):
+        # pgeocode keeps the whole GeoNames table of the country in _data, there's no public accessor for it
+        return cls(nomi._data)
+
+    def __len__(self):
+        return len(self.places)
+
+    def resolve(self, name, state = None):
+        '''
+        input:  [string] place name, [string] state code to limit it to
+        output: [tuple] (latitude, longitude) of the place, the state with most zipcodes if state is None, None if unknown
+        "St" and "Ft" are tried as "Saint" and "Fort" too.
+        '''
+        name = re.sub(r"\s+", " ", name.strip().lower().replace(".", ""))
+        names = [name, re.sub(r"^st ", "saint ", name), re.sub(r"^ft ", "fort ", name)]
+        for candidate in names:
+            for entry_state, latitude, longitude, count in self.places.get(candidate, []):
+                if state is None or entry_state == state:
+                    return (latitude, longitude)
+        return None
+
+    def split_state(self, query):
+        '''
+        input:  [string] query
+        output: [string] query without a state at its start or end, [string] code of that state, None if there's none
+        Two letter codes count only when they're in capitals or after a comma, so "in" or "me" aren't taken for states.
+        '''
+        parts = [part.strip() for part in query.split(",") if part.strip() != ""]
+        if len(parts) > 1 and parts[-1].lower() in self.states:
+            return ", ".join(parts[:-1]), self.states[parts[-1].lower()]
+
+        words = query.replace(",", " ").split()
+        for size in (2, 1):
+            if len(words) <= size:
+                continue
+            for rest, state in ((words[:-size], words[-size:]), (words[size:], words[:size])):
+                state = " ".join(state)
+                if state.lower() not in self.states:
+                    continue
+                if len(state) == 2 and not state.isupper():
+                    continue
+                return " ".join(rest), self.states[state.lower()]
+        return query, None
+
+    def __call__(self, query):
+        '''
+        input:  [string] place, zipcode or "place, state", with or without ", United States of America"
+        output: [tuple] (latitude, longitude), None if it isn't a known place or zipcode
+        same calls as geocache.RemoteGeocoder, so it can stand in for it
+        '''
+        query = query.strip()
+        for suffix in COUNTRY_SUFFIXES:
+            if query.lower().endswith(suffix):
+                query = query[:-len(suffix)].strip()
+                break
+        if re.fullmatch(r"\d{5}", query):
+            return self.zips.get(query)
+        cords = self.resolve(query.replace(",", " "))
+        if cords is not None:
+            return cords
+        place, state = self.split_state(query)
+        if state is None:
+            return None
+        return self.resolve(place.replace(",", " "), state)
+
+
+class StationZips:
+
+    # station zipcodes with centroids of those zipcodes from zips = {<zipcode>: (latitude, longitude)}, and a
+    # GeoIndex (in km) over the centroids found, None if none is. rows[i] is the station row of centroid i, numbers the zipcodes
+    # as ints (-1 if not a number) for zipcodes whose centroid is unknown.
+    def __init__(self, codes, zipcodes, zips):
+        self.codes = codes
+        padded = [str(zipcode).zfill(5) if str(zipcode).isdigit() else None for zipcode in zipcodes]
+        self.numbers = np.array([int(zipcode) if zipcode is not None else -1 for zipcode in padded], dtype=np.int64)
+        self.zips = zips
+        self.rows = np.array([i for i, zipcode in enumerate(padded) if zipcode in zips], dtype=np.int64)
+        self.index = GeoIndex([zips[padded[i]] for i in self.rows.tolist()], EARTH_RADIUS_KM) if len(self.rows) != 0 else None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def nearest(self, zipcode, km):
+        '''
+        input:  [string] zipcode, [float] km
+        output: [string] code of the station with zipcode centroid closest to the centroid of zipcode, the first one
+                in row order if several share it, None if zipcode is unknown or no station is within km
+        '''
+        cords = self.zips.get(zipcode.zfill(5))
+        if cords is None or len(self.rows) == 0:
+            return None
+        distances, idx = self.index.nearest(cords)
+        if distances[0] >= km:
+            return None
+        return self.codes[self.rows[idx[0]]]
+
+    def closest_number(self, zipcode, proximity = ZIP_PROXIMITY):
+        '''
+        input:  [string] zipcode, [int] proximity
+        output: [string] code of the first station with zipcode number closest to zipcode, None if none is within proximity
+        used when the centroid of zipcode isn't known
+        '''
+        gaps = np.where(self.numbers >= 0, np.abs(self.numbers - int(zipcode)), proximity)
+        if len(gaps) == 0 or gaps.min() >= proximity:
+            return None
+        return self.codes[int(np.argmin(gaps))]
+
+
+def GetGazetteer(nomi):
+    '''
+    input:  [pgeocode.Nominatim Object] nomi of the US
+    output: [Gazetteer Object] built from its table the first time, kept in memory afterwards
+    '''
+    global gazetteer_
+    if gazetteer_ is None:
+        gazetteer_ = Gazetteer.from_pgeocode(nomi)
+    return gazetteer_
+
+
+def GetStationZips(nomi, registry):
+    '''
+    input:  [pgeocode.Nominatim Object] nomi of the US, [backend.StationRegistry Object] registry
+    output: [StationZips Object] of the stations of registry, made the first time, kept in memory afterwards
+    '''
+    global station_zips_
+    if station_zips_ is None or station_zips_.codes is not registry.codes:
+        station_zips_ = StationZips(registry.codes, registry.zips, GetGazetteer(nomi).zips)
+    return station_zips_
+
+
+def BenchmarkGazetteer(gazetteer, remote, queries, verbose = 1):
+    '''
+    input:  [Gazetteer Object] gazetteer, remote geocoder (like geocache.RemoteGeocoder), [list of strings] queries
+    output: [dict] average seconds per query of both, how many each resolved and how far apart their answers are (miles)
+    errors of the remote geocoder (no connection, rate limits) are counted and not timed
+    '''
+    result = {"gazetteer_found": 0, "remote_found": 0, "remote_errors": 0, "differences": []}
+    t = time.time()
+    local = [gazetteer(query) for query in queries]
+    result["gazetteer_query"] = (time.time() - t) / len(queries)
+    result["gazetteer_found"] = sum(cords is not None for cords in local)
+
+    remote_time = 0
+    for query, local_cords in zip(queries, local):
+        t = time.time()
+        try:
+            cords = remote(query)
+        except Exception:
+            result["remote_errors"] += 1
+            continue
+        remote_time += time.time() - t
+        if cords is None:
+            continue
+        result["remote_found"] += 1
+        if local_cords is not None:
+            result["differences"].append(Distance(local_cords, cords))
+    answered = len(queries) - result["remote_errors"]
+    result["remote_query"] = remote_time / answered if answered != 0 else None
+
+    if verbose:
+        print("gazetteer:", round(result["gazetteer_query"] * 1e6, 1), "us per query,", result["gazetteer_found"], "of",
+              len(queries), "found")
+        if result["remote_query"] is None:
+            print("remote geocoder: no answers,", result["remote_errors"], "errors")
+        else:
+            print("remote geocoder:", round(result["remote_query"] * 1000, 1), "ms per query,", result["remote_found"],
+                  "found,", result["remote_errors"], "errors")
+        if len(result["differences"]) != 0:
+            print("median distance between answers:", round(float(np.median(result["differences"])), 2), "miles")
+    return result
@@ -0,0 +1,155 @@
+'''
+Geocache would be responsible
+- for remembering geocoded places on disk, so a query is sent to the geocoder only once
+- for forgetting them after a while, and remembering places that weren't found for a shorter while
+- for standing in for the remote geocoder with a local table in offline tests
+'''
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+#paramters
+GEOCODE_TTL = 30 * 24 * 3600    # seconds a found place is kept
+NOT_FOUND_TTL = 24 * 3600       # seconds a place not found is kept
+
+
+def NormaliseQuery(query):
+    '''
+    input:  [string] place to geocode
+    output: [string] query in lowercase with whitespace and commas tidied, used as the cache key
+    '''
+    query = re.sub(r"\s*,\s*", ", ", query.strip().lower())
+    return re.sub(r"\s+", " ", query)
+
+
+class RemoteGeocoder:
+
+    # calls geopy geocoder, like geopy.geocoders.Nominatim, returns (latitude, longitude) or None
+    def __init__(self, geolocator):
+        self.geolocator = geolocator
+
+    def __call__(self, query):
+        location = self.geolocator.geocode(query)
+        if location == None:
+            return None
+        return tuple(location[-1])
+
+
+class LocalGeocoder:
+
+    # stand in for RemoteGeocoder answering from places = {<query>: (latitude, longitude)}, queries are
+    # normalised so "Evanston, IL" and "evanston,il" are the same. calls counts queries answered.
+    def __init__(self, places = None):
+        self.places = {NormaliseQuery(query): tuple(cords) for query, cords in (places or {}).items()}
+        self.calls = 0
+
+    # adds place to the table
+    def add(self, query, cords):
+        self.places[NormaliseQuery(query)] = tuple(cords)
+
+    def __call__(self, query):
+        self.calls += 1
+        return self.places.get(NormaliseQuery(query))
+
+
+class GeocodeCache:
+
+    # answers geocode queries from memory, then from the sqlite file at path, and asks geocoder(query) only when
+    # neither has a fresh answer. places not found are cached too, for not_found_ttl seconds instead of ttl.
+    # table geocodes(query, latitude, longitude, found, time), memory = {<query>: (<cords or None>, <time>)}
+    def __init__(self, path, geocoder, ttl = GEOCODE_TTL, not_found_ttl = NOT_FOUND_TTL):
+        self.path = path
+        self.geocoder = geocoder
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.lock = threading.RLock()
+        self.memory = {}
+        self.hits = 0
+        self.not_found_hits = 0
+        self.misses = 0
+        self.geocoder_time = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS geocodes (query TEXT PRIMARY KEY, latitude REAL, "
+                        "longitude REAL, found INTEGER, time REAL)")
+        self.db.commit()
+
+    # printing cache would be "GeocodeCache(<stats>)"
+    def __str__(self):
+        return "GeocodeCache(" + str(self.stats()) + ")"
+
+    # returns whether answer cached at time t is still fresh
+    def is_fresh(self, cords, t):
+        return time.time() - t < (self.ttl if cords is not None else self.not_found_ttl)
+
+    def lookup(self, query):
+        '''
+        input:  [string] normalised query
+        output: [bool] whether a fresh answer is cached, [tuple or None] the answer
+        '''
+        with self.lock:
+            if query not in self.memory:
+                row = self.db.execute("SELECT latitude, longitude, found, time FROM geocodes WHERE query = ?",
+                                      (query,)).fetchone()
+                if row is None:
+                    return False, None
+                self.memory[query] = ((row[0], row[1]) if row[2] else None, row[3])
+            cords, t = self.memory[query]
+            if not self.is_fresh(cords, t):
+                return False, None
+            return True, cords
+
+    def store(self, query, cords):
+        '''
+        saves answer of normalised query, None if it wasn't found
+        '''
+        t = time.time()
+        with self.lock:
+            self.memory[query] = (cords, t)
+            latitude, longitude = cords if cords is not None else (None, None)
+            self.db.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)",
+                            (query, latitude, longitude, int(cords is not None), t))
+            self.db.commit()
+
+    def geocode(self, query):
+        '''
+        input:  [string] place
+        output: [tuple] (latitude, longitude) of the place, None if the geocoder didn't find it
+        errors of the geocoder (like timeouts) are raised and not cached
+        '''
+        key = NormaliseQuery(query)
+        cached, cords = self.lookup(key)
+        with self.lock:
+            if cached:
+                self.hits += 1
+                if cords is None: self.not_found_hits += 1
+                return cords
+            self.misses += 1
+
+        t = time.time()
+        cords = self.geocoder(query)
+        with self.lock:
+            self.geocoder_time += time.time() - t
+        cords = tuple(cords) if cords is not None else None
+        self.store(key, cords)
+        return cords
+
+    # returns dict of queries answered from the cache, how many of those were not found, geocoder calls,
+    # hit rate and seconds spent waiting for the geocoder
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "not_found_hits": self.not_found_hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups != 0 else 0, "geocoder_time": self.geocoder_time}
+
+    # drops every cached answer, in memory and on disk
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.db.execute("DELETE FROM geocodes")
+            self.db.commit()
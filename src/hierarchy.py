@@ -0,0 +1,310 @@
+'''
+Contraction hierarchies would be responsible
+- for ordering and contracting stations of backend.Graph offline, adding shortcuts
+- for saving and loading the contracted index
+- for answering findPath queries by searching only upwards from both ends
+'''
+
+import heapq
+import os
+import time
+import numpy as np
+import backend
+from backend import UNREACHED, CSRGraph, SaveAtomic, LoadOrBuild
+
+#paramters
+WITNESS_LIMIT = 60   # max stations settled by one witness search, after that a shortcut is added anyway
+
+
+def Contract(csr, verbose = 0):
+    '''
+    input:  [CSRGraph Object] csr
+    output: [array] rank of each station, [array] frm, [array] to, [array] weight, [array] middle
+    Contracts stations one by one, cheapest first, where cost is the edge difference
+    (shortcuts needed - connections removed + neighbours already contracted). A shortcut u -> w
+    is added over contracted v unless a witness path u -> w avoiding v is as short.
+    Returns every connection and shortcut that ends up in the hierarchy, middle = -1 for
+    original connections and the contracted station for shortcuts.
+    '''
+
+    n = len(csr)
+    #outs[u] = {w: (distance, middle)}, ins[w] = {u: (distance, middle)}
+    outs = [dict() for i in range(n)]
+    ins = [dict() for i in range(n)]
+    for u in range(n):
+        for k in range(csr.indptr_list[u], csr.indptr_list[u + 1]):
+            v, weight = csr.indices_list[k], csr.weights_list[k]
+            if v != u and (v not in outs[u] or weight < outs[u][v][0]):
+                outs[u][v] = (weight, -1)
+                ins[v][u] = (weight, -1)
+
+    contracted = [False] * n
+    deleted_neighbours = [0] * n
+    rank = np.zeros(n, dtype=np.int32)
+    frm, to, weights, middles = [], [], [], []
+
+    def witness(u, v, limit):
+        #distances from u without passing v, settling at most WITNESS_LIMIT stations
+        dist = {u: 0}
+        Q = [(0, u)]
+        settled = 0
+        while len(Q) != 0 and settled < WITNESS_LIMIT:
+            d, x = heapq.heappop(Q)
+            if d > dist[x]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for y, (weight, mid) in outs[x].items():
+                if y == v:
+                    continue
+                if d + weight < dist.get(y, UNREACHED):
+                    dist[y] = d + weight
+                    heapq.heappush(Q, (d + weight, y))
+        return dist
+
+    def shortcuts(v):
+        #shortcuts needed to contract v, [(u, w, distance)]
+        needed = []
+        if len(outs[v]) == 0:
+            return needed
+        for u, (w_in, mid) in ins[v].items():
+            limit = w_in + max(weight for weight, mid in outs[v].values())
+            dist = witness(u, v, limit)
+            for w, (w_out, mid) in outs[v].items():
+                if w == u:
+                    continue
+                if dist.get(w, UNREACHED) > w_in + w_out:
+                    needed.append((u, w, w_in + w_out))
+        return needed
+
+    def priority(v):
+        return len(shortcuts(v)) - len(ins[v]) - len(outs[v]) + deleted_neighbours[v]
+
+    Q = [(priority(v), v) for v in range(n)]
+    heapq.heapify(Q)
+    order = 0
+    while len(Q) != 0:
+        p, v = heapq.heappop(Q)
+        if contracted[v]:
+            continue
+        #lazy update, contract only if still cheapest
+        p = priority(v)
+        if len(Q) != 0 and p > Q[0][0]:
+            heapq.heappush(Q, (p, v))
+            continue
+
+        needed = shortcuts(v)
+        #remaining connections of v all go to stations contracted later
+        for w, (weight, mid) in outs[v].items():
+            frm.append(v); to.append(w); weights.append(weight); middles.append(mid)
+            del ins[w][v]
+            deleted_neighbours[w] += 1
+        for u, (weight, mid) in ins[v].items():
+            frm.append(u); to.append(v); weights.append(weight); middles.append(mid)
+            del outs[u][v]
+            deleted_neighbours[u] += 1
+        for u, w, weight in needed:
+            if w not in outs[u] or weight < outs[u][w][0]:
+                outs[u][w] = (weight, v)
+                ins[w][u] = (weight, v)
+        outs[v] = {}
+        ins[v] = {}
+        contracted[v] = True
+        rank[v] = order
+        order += 1
+        if verbose and order % 100 == 0: print(order, "stations contracted")
+
+    return (rank, np.array(frm, dtype=np.int32), np.array(to, dtype=np.int32),
+            np.array(weights, dtype=np.float64), np.array(middles, dtype=np.int32))
+
+
+class ContractionHierarchy:
+
+    # contracted index of a CSRGraph. rank[i] is when station i was contracted, every connection and
+    # shortcut frm[e] -> to[e] of length weight[e] skips over station middle[e] (-1 if it's a real connection).
+    # up is the CSR of connections towards higher ranks, down is the CSR of incoming connections from higher ranks.
+    def __init__(self, codes, rank, frm, to, weight, middle, checksum):
+        self.codes = list(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.rank = rank
+        self.frm = frm
+        self.to = to
+        self.weight = weight
+        self.middle = middle
+        self.checksum = checksum
+
+        #splitting connections by direction in the order, searches from both ends only go upwards
+        upward = rank[frm] < rank[to]
+        coords = np.zeros((len(self.codes), 2))
+        self.up = CSRGraph.from_edges(self.codes, coords, frm[upward], to[upward], weight[upward])
+        self.down = CSRGraph.from_edges(self.codes, coords, to[~upward], frm[~upward], weight[~upward])
+
+        # middles = {(<frm>, <to>): <middle>}, for unpacking shortcuts
+        self.middles = dict(zip(zip(frm.tolist(), to.tolist()), middle.tolist()))
+
+    # contracts the graph
+    @classmethod
+    def build(cls, csr, verbose = 0):
+        rank, frm, to, weight, middle = Contract(csr, verbose)
+        return cls(csr.codes, rank, frm, to, weight, middle, csr.get_checksum())
+
+    # saves index into a binary .npz file
+    def save(self, path):
+        SaveAtomic(path, lambda f: np.savez(f, codes=np.array(self.codes), rank=self.rank, frm=self.frm, to=self.to,
+                                            weight=self.weight, middle=self.middle, checksum=np.array(self.checksum)))
+
+    # loads index saved with save()
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(f["codes"].tolist(), f["rank"], f["frm"], f["to"], f["weight"], f["middle"], str(f["checksum"]))
+
+    # returns number of bytes used by the index arrays
+    def nbytes(self):
+        return self.rank.nbytes + self.frm.nbytes + self.to.nbytes + self.weight.nbytes + self.middle.nbytes
+
+    # returns number of shortcuts
+    def num_shortcuts(self):
+        return int(np.count_nonzero(self.middle != -1))
+
+    # printing hierarchy would be "ContractionHierarchy(<n> stations, <m> connections, <s> shortcuts, <x> MB)"
+    def __str__(self):
+        return ("ContractionHierarchy(" + str(len(self.codes)) + " stations, " + str(len(self.frm)) + " connections, "
+                + str(self.num_shortcuts()) + " shortcuts, " + str(round(self.nbytes() / 2**20, 3)) + " MB)")
+
+    def query(self, src, dest, stats = None):
+        '''
+        input:  [int, station index] src, [int, station index] dest, [dict] stats
+        output: [float] distance from src to dest (UNREACHED if not reachable), [list of station indices] path
+        Dijkstra upwards from src and upwards (over incoming connections) from dest, the shortest
+        path goes up then down the order so it's found where both searches meet.
+        '''
+
+        sides = (self.up, self.down)
+        dist = ({src: 0}, {dest: 0})
+        prev = ({src: -1}, {dest: -1})
+        settled = (set(), set())
+        Q = ([(0, src)], [(0, dest)])
+        best = UNREACHED
+        meet = -1
+        expanded = 0
+
+        #each side stops once its queue top can't improve the best meeting point
+        while True:
+            forward = len(Q[0]) != 0 and Q[0][0][0] < best
+            backward = len(Q[1]) != 0 and Q[1][0][0] < best
+            if not forward and not backward:
+                break
+            side = 0 if forward and (not backward or Q[0][0][0] <= Q[1][0][0]) else 1
+            d, u = heapq.heappop(Q[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            expanded += 1
+            if u in dist[1 - side] and d + dist[1 - side][u] < best:
+                best = d + dist[1 - side][u]
+                meet = u
+            graph = sides[side]
+            for k in range(graph.indptr_list[u], graph.indptr_list[u + 1]):
+                v = graph.indices_list[k]
+                alt = d + graph.weights_list[k]
+                if alt < dist[side].get(v, UNREACHED):
+                    dist[side][v] = alt
+                    prev[side][v] = u
+                    heapq.heappush(Q[side], (alt, v))
+
+        if stats is not None:
+            stats["expanded"] = expanded
+        if meet == -1:
+            return UNREACHED, []
+
+        #hierarchy path src -> meet -> dest, then shortcuts unpacked into real connections
+        up_path = [meet, ]
+        while prev[0][up_path[-1]] != -1:
+            up_path.append(prev[0][up_path[-1]])
+        up_path = up_path[::-1]
+        while prev[1][up_path[-1]] != -1:
+            up_path.append(prev[1][up_path[-1]])
+        path = [src, ]
+        for u, v in zip(up_path, up_path[1:]):
+            self.unpack(u, v, path)
+        return best, path
+
+    # appends stations after u on connection u -> v, expanding shortcuts recursively
+    def unpack(self, u, v, path):
+        stack = [(u, v)]
+        while len(stack) != 0:
+            a, b = stack.pop()
+            m = self.middles[(a, b)]
+            if m == -1:
+                path.append(b)
+            else:
+                stack.append((m, b))
+                stack.append((a, m))
+
+
+hierarchy_ = None
+
+def GetHierarchy(verbose = 0):
+    '''
+    output: [ContractionHierarchy Object] index of backend.dataset_.graph
+    Loads the index from the cache folder, keyed by hash of the data files, or contracts
+    the graph and saves it the first time. It's kept in memory afterwards.
+    '''
+
+    global hierarchy_
+    csr = backend.dataset_.graph.get_csr()
+    checksum = csr.get_checksum()
+    if hierarchy_ is not None and hierarchy_.checksum == checksum:
+        return hierarchy_
+
+    #loading saved index if it was built from same graph
+    filename = os.path.join(backend.dataset_.cache_path, "ch_" + backend.dataset_.get_hash() + ".npz")
+    t = time.time()
+    hierarchy_, loaded = LoadOrBuild(filename, ContractionHierarchy.load, lambda: ContractionHierarchy.build(csr, verbose),
+                                     ContractionHierarchy.save, checksum)
+    if verbose and loaded:
+        print("loaded", hierarchy_, "from", filename)
+    elif verbose:
+        print("built", hierarchy_, "in", round(time.time() - t, 3), "secs")
+    return hierarchy_
+
+
+def BenchmarkHierarchy(queries = 500, verbose = 1):
+    '''
+    input:  [int] number of random station pairs to query
+    output: [dict] preprocessing time, index size and average query latency of the hierarchy and Dijkstra
+    Contracts backend.dataset_.graph from scratch, checks every query against DijkstraCSR and compares timings.
+    '''
+
+    csr = backend.dataset_.graph.get_csr()
+    t = time.time()
+    index = ContractionHierarchy.build(csr)
+    result = {"preprocessing": time.time() - t, "index_bytes": index.nbytes(), "graph_bytes": csr.nbytes(),
+              "shortcuts": index.num_shortcuts()}
+
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, len(csr), size=(queries, 2)).tolist()
+
+    t = time.time()
+    expected = [float(backend.DijkstraCSR(src, dest, csr)[0][dest]) for src, dest in pairs]
+    result["dijkstra_query"] = (time.time() - t) / queries
+
+    t = time.time()
+    found = [index.query(src, dest)[0] for src, dest in pairs]
+    result["ch_query"] = (time.time() - t) / queries
+    result["mismatches"] = sum(abs(a - b) > 1e-6 for a, b in zip(expected, found))
+
+    if verbose:
+        print(index)
+        print("preprocessing:", round(result["preprocessing"], 3), "secs")
+        print("index size:", result["index_bytes"], "bytes, graph size:", result["graph_bytes"], "bytes")
+        print("dijkstra query:", round(result["dijkstra_query"] * 1000, 4), "ms")
+        print("hierarchy query:", round(result["ch_query"] * 1000, 4), "ms")
+        print(result["mismatches"], "mismatched distances in", queries, "queries")
+    return result
+
+
+if __name__ == '__main__':
+    BenchmarkHierarchy()
@@ -3,53 +3,591 @@ Generates images of map/routes
 '''
 
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import math
 import numpy as np
 import os
 import random
-from backend import data_, graph_, findPath
-from threading import Thread
+import struct
+import zlib
+from backend import dataset_, findPath, SaveAtomic, LoadOrBuild
+from spatial import KDTree
+from threading import Thread, Lock, Event
 import time
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 dir_path = os.path.join(dir_path, "..", "static")
+cache_path = os.path.join(dir_path, "cache")
+
+#paramters
+BASE_MAP_VERSION = 1    # increase whenever drawing of the network changes, older cached base maps get redrawn
+BASE_STYLE = {"path_color": "white", "path_width": 8, "station_color": "red", "station_radius": 9}
+LAYER_MARGIN = 10   # pixels around the stations of a route layer, more than its widest line or circle
+DIRTY_LIMIT = 64    # max changed boxes tracked separately, more than that are merged into one
+TILE_SIZE = 512     # width and height of a tile in pixels of its level
+TILE_CACHE_SIZE = 128   # max tiles kept in memory per pyramid, about 100 MB
+LABEL_FONT = ('OpenSans-BoldItalic.ttf', 15)   # face and size of station labels
+LABEL_COLOR = (245, 233, 66)
+LABEL_MARGIN = 8    # pixels around a label bitmap, more than its glyphs reach past their bounding box
+RENDER_TILE_SIZE = 1024     # width and height of tiles drawn by separate worker processes
+PNG_BAND_ROWS = 64  # rows of a png compressed at once, progress is reported and cancelling checked after each
+# export formats, {<name>: (<extension>, <PIL format>, <default options>)}, png is written by WritePNG
+EXPORT_FORMATS = {"png": (".png", "PNG", {"compress_level": 1, "filtered": False}),
+                  "jpeg": (".jpg", "JPEG", {"quality": 90}),
+                  "webp": (".webp", "WEBP", {"quality": 80, "method": 4})}
+
+#rendered base maps (map with all routes and stations), {<key>: <PIL image>}
+base_maps_ = {}
+base_maps_lock_ = Lock()
+
+#fonts loaded, {(<face>, <size>): <FreeTypeFont>}
+fonts_ = {}
+#label bitmaps, {(<text>, <face>, <size>, <fraction of x>, <fraction of y>): <L image>}
+labels_ = {}
+
+#pixel KD-trees of stations, {(<projection key>, <hash of station data>): (<codes>, <KDTree>)}
+pixel_index_ = {}
+#projections already set up, {(<world map path>, <image size factor>): <MapProjection>}
+projections_ = {}
+
+class MapProjection:
+
+  # mercator projection of cordinates onto a world map of world_size = (width, height) pixels,
+  # translated and scaled to the US map. only the size of the world map is needed.
+  def __init__(self, world_size, image_size_factor = 4, offset = (1146, 1862), correction = (8, 4)):
+    self.world_width, self.world_height = world_size
+    self.image_size_factor = image_size_factor
+    self.offset = offset
+    self.correction = correction
+
+  def key(self):
+    '''
+    returns tuple identifying this projection, station pixels are cached under it
+    '''
+    return (self.world_width, self.world_height, self.image_size_factor, self.offset, self.correction)
+
+  def project(self, lats, longs):
+    '''
+    input: latitudes and longitudes, numbers or arrays of any shape
+    output: x and y pixel locations on the US map, same shape as input
+    '''
+    #calculating pixels values (x and y) from cordinates
+    x = (np.asarray(longs) + 180) * (self.world_width / 360)
+    latRad = np.asarray(lats) * np.pi / 180
+    mercN = np.log(np.tan((np.pi / 4) + (latRad / 2)))
+    y = (self.world_height / 2) - (self.world_width * mercN / (2 * np.pi))
+
+    #translating those pixels from world map to us map
+    x_corrected, y_corrected = x + self.correction[0], y + self.correction[1]
+    x_new = self.image_size_factor * (x_corrected - self.offset[0])
+    y_new = self.image_size_factor * (y_corrected - self.offset[1])
+    return x_new, y_new
+
+  def station_pixels(self):
+    '''
+    output: [array of shape (n, 2)] pixel location of every station, in the order of the station registry
+    projected in one pass the first time, then kept in the registry under key()
+    '''
+    return dataset_.get_registry().get_pixels(self.key(), self.project)
+
+  def station_pixel(self, code):
+    '''
+    input: station code
+    output: [x, y] pixel location of the station
+    '''
+    self.station_pixels()
+    return dataset_.get_registry().get_pixel(code, self.key())
+
+
+def GetProjection(world_path = "static/worldmap.jpg", image_size_factor = 4):
+  '''
+  returns the MapProjection for the world map at world_path, only its header is read for the size
+  '''
+  key = (world_path, image_size_factor)
+  if key not in projections_:
+    with Image.open(world_path) as worldmap:
+      projections_[key] = MapProjection(worldmap.size, image_size_factor)
+  return projections_[key]
+
+
+def BaseMapKey(path, style):
+  '''
+  returns key of the base map of path drawn with style, it changes whenever the station data,
+  the map file, the projection or the style change
+  '''
+  stat = os.stat(path)
+  parts = [BASE_MAP_VERSION, dataset_.get_hash(), os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+           GetProjection("static/worldmap.jpg").key(), sorted(style.items())]
+  return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def GetBaseMap(path = "static/usmap.jpeg", style = None, verbose = False, workers = 1):
+  '''
+  input: path of the map image, style of the network (BASE_STYLE by default), processes drawing it
+  output: PIL image of the map with all routes and stations drawn. don't draw on it, copy it first
+  It's drawn once and kept in memory and in static/cache, later calls and later runs reuse it.
+  '''
+  style = dict(BASE_STYLE, **(style or {}))
+  key = BaseMapKey(path, style)
+  with base_maps_lock_:
+    if key in base_maps_:
+      return base_maps_[key]
+
+    #loading from disk if it was drawn in an earlier run
+    filename = os.path.join(cache_path, "base_" + key + ".png")
+    def draw():
+      img = MyImage(path)
+      img.plot_network(style["path_color"], style["path_width"], style["station_color"], style["station_radius"],
+                       workers = workers, verbose = verbose)
+      return img.im
+
+    t = time.time()
+    base, loaded = LoadOrBuild(filename, lambda filename: Image.open(filename).convert('RGB'), draw,
+                               lambda base, filename: SaveAtomic(filename, lambda f: base.save(f, "PNG", compress_level = 1)))
+    if verbose and loaded:
+      print("loaded base map from", filename, "in", round(time.time() - t, 3), "secs")
+    elif verbose:
+      print("drew base map in", round(time.time() - t, 3), "secs, saved at", filename)
+    base_maps_[key] = base
+    return base
+
+
+def GetFont(face = LABEL_FONT[0], size = LABEL_FONT[1]):
+  '''
+  returns the font face at size, the font file is read only the first time
+  '''
+  key = (face, size)
+  if key not in fonts_:
+    fonts_[key] = ImageFont.truetype(face, size)
+  return fonts_[key]
+
+
+def GetLabel(text, x, y, face = LABEL_FONT[0], size = LABEL_FONT[1]):
+  '''
+  input: text, position (x, y) it is drawn at, font face and size
+  output: [L image] coverage of the text glyphs, LABEL_MARGIN pixels around the point (int(x), int(y))
+  Glyphs are placed by the fraction of x and y too, so the label is kept for that fraction.
+  Pasting LABEL_COLOR through it at (int(x) - LABEL_MARGIN, int(y) - LABEL_MARGIN) gives the same pixels as ImageDraw.text.
+  '''
+  fraction_x, fraction_y = math.modf(x)[0], math.modf(y)[0]
+  key = (text, face, size, fraction_x, fraction_y)
+  if key not in labels_:
+    font = GetFont(face, size)
+    left, top, right, bottom = font.getbbox(text)
+    label = Image.new('L', (right + 2 * LABEL_MARGIN, bottom + 2 * LABEL_MARGIN))
+    ImageDraw.Draw(label).text((LABEL_MARGIN + fraction_x, LABEL_MARGIN + fraction_y), text, 255, font = font)
+    labels_[key] = label
+  return labels_[key]
+
+
+def DrawLabel(im, draw, text, x, y, origin = (0, 0)):
+  '''
+  input: image covering the map from origin, its ImageDraw, text and its position (x, y) on the map
+  output: box of im drawn on
+  Pastes the cached label of text, or draws it when it starts left of or above the map.
+  '''
+  if x >= 0 and y >= 0:
+    label = GetLabel(text, x, y)
+    left, top = int(x) - LABEL_MARGIN - origin[0], int(y) - LABEL_MARGIN - origin[1]
+    box = (left, top, left + label.width, top + label.height)
+    im.paste(LABEL_COLOR, box, label)
+    return box
+  draw.text((x - origin[0], y - origin[1]), text, LABEL_COLOR, font = GetFont())
+  return draw.textbbox((x - origin[0], y - origin[1]), text, font = GetFont())
+
+
+def RenderTile(task):
+  '''
+  input: (image, its origin on the map, lines, circles) as made by MyImage.plot_network
+  output: image with the lines and then the circles drawn on it
+  Runs in a worker process, shapes are in map pixels and get shifted to the image.
+  '''
+  tile, origin, lines, circles = task
+  draw = ImageDraw.Draw(tile)
+  for x1, y1, x2, y2, color, width in lines:
+    draw.line((x1 - origin[0], y1 - origin[1], x2 - origin[0], y2 - origin[1]), fill = color, width = width)
+  for x, y, radius, color, text in circles:
+    draw.ellipse((x - radius - origin[0], y - radius - origin[1], x + radius - origin[0], y + radius - origin[1]),
+                 fill = color, outline = color)
+    if text != None:
+      offset = int(np.sqrt(2) * radius) + 3
+      DrawLabel(tile, draw, text, x + offset, y - offset, origin)
+  return tile
+
+
+def BenchmarkLabels(path = "static/usmap.jpeg", repeat = 3, verbose = 1):
+  '''
+  input: path of the map image, number of times every way is timed
+  output: [dict] best seconds taken by plot_stations with fonts loaded and labels drawn on every call
+  (as before the caches), with empty caches, and with the caches filled
+  '''
+  img = MyImage(path)
+  result = {"uncached": float("inf"), "cold": float("inf"), "warm": float("inf")}
+  for i in range(repeat):
+    #loading font and drawing text for every station
+    t = time.time()
+    for code, (x, y) in zip(dataset_.get_registry().codes, img.station_pixels().tolist()):
+      img.draw_circle((x, y), color = "red", radius = 9)
+      offset = int(np.sqrt(2) * 9) + 3
+      img.draw.text((x + offset, y - offset), code, LABEL_COLOR, font = ImageFont.truetype(*LABEL_FONT))
+    result["uncached"] = min(result["uncached"], time.time() - t)
+
+    fonts_.clear()
+    labels_.clear()
+    t = time.time()
+    img.plot_stations()
+    result["cold"] = min(result["cold"], time.time() - t)
+
+    t = time.time()
+    img.plot_stations()
+    result["warm"] = min(result["warm"], time.time() - t)
+
+  if verbose:
+    print("plot_stations loading font for every label:", round(result["uncached"], 4), "secs")
+    print("plot_stations with empty caches:", round(result["cold"], 4), "secs")
+    print("plot_stations with font and labels cached:", round(result["warm"], 4), "secs")
+  return result
+
+
+def RandomColor():
+  '''
+  gives random but new color each time, as a "#rrggbb" string
+  '''
+  random_number = random.randint(0,16777215)
+  hex_number = str(hex(random_number))
+  color = hex_number[2:]
+  while (len(color) < 6):
+    color = "0" + color
+  return "#" + color
+
+
+def InvertColor(color):
+  '''
+  takes in the string representing the hexadecimal value of a color and returns its inverted color as a hexadecimal string
+  '''
+  hex1 = int(color[1:],16)
+  hex_max = int("ffffff",16)
+  inverted = hex_max-hex1
+  str_inverted = str(hex(inverted))[2:]
+  while (len(str_inverted) < 6):
+    str_inverted = "0" + str_inverted
+  return "#" + str_inverted
+
+
+def MergeBoxes(boxes):
+  '''
+  returns smallest box (left, top, right, bottom) covering all boxes
+  '''
+  return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+          max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+class RouteLayer:
+
+  # one route drawn on its own transparent image. im covers box = (left, top, right, bottom) of the map,
+  # outside of the drawn lines and circles it's fully transparent so it can be composited over anything.
+  def __init__(self, path, color, box, im):
+    self.path = list(path)
+    self.color = color
+    self.box = box
+    self.im = im
+
+  # returns part of box which overlaps other box, None if they don't overlap
+  def overlap(self, box):
+    left, top = max(self.box[0], box[0]), max(self.box[1], box[1])
+    right, bottom = min(self.box[2], box[2]), min(self.box[3], box[3])
+    if left >= right or top >= bottom:
+      return None
+    return (left, top, right, bottom)
+
+
+class TilePyramid:
+
+  # tiles of a MyImage at multiple resolutions. level 0 is the image itself, every level above is half the
+  # size of the one below, up to the level fitting in one tile. a tile is made the first time it's needed,
+  # cropped from the image at level 0 or shrunk from the four tiles under it, and kept in a bounded
+  # least recently used cache, tiles = {(<level>, <tx>, <ty>): <PIL image>}
+  def __init__(self, image, tile_size = TILE_SIZE, cache_size = TILE_CACHE_SIZE):
+    self.image = image
+    self.tile_size = tile_size
+    self.cache_size = cache_size
+    self.tiles = OrderedDict()
+    self.levels = 1
+    while max(self.level_size(self.levels - 1)) > tile_size:
+      self.levels += 1
+
+  # returns (width, height) of the image at level
+  def level_size(self, level):
+    return (-(-self.image.width // 2 ** level), -(-self.image.height // 2 ** level))
+
+  # returns coarsest level still showing at least one pixel per screen pixel at scale (screen pixels per image pixel)
+  def level_for(self, scale):
+    if scale >= 1:
+      return 0
+    return min(int(np.floor(-np.log2(scale))), self.levels - 1)
+
+  # returns box (left, top, right, bottom) of tile tx, ty in pixels of level
+  def tile_box(self, level, tx, ty):
+    width, height = self.level_size(level)
+    return (tx * self.tile_size, ty * self.tile_size,
+            min((tx + 1) * self.tile_size, width), min((ty + 1) * self.tile_size, height))
+
+  def tiles_in(self, level, box):
+    '''
+    input: level, box (left, top, right, bottom) in pixels of level
+    output: [list of (tx, ty, tile box)] tiles of level overlapping box
+    '''
+    width, height = self.level_size(level)
+    left, top = max(int(box[0]) // self.tile_size, 0), max(int(box[1]) // self.tile_size, 0)
+    right = min(int(np.ceil(box[2])), width) - 1
+    bottom = min(int(np.ceil(box[3])), height) - 1
+    return [(tx, ty, self.tile_box(level, tx, ty)) for ty in range(top, bottom // self.tile_size + 1)
+            for tx in range(left, right // self.tile_size + 1)]
+
+  def get_tile(self, level, tx, ty):
+    '''
+    output: [PIL image] tile tx, ty of level, from the cache if it's there
+    '''
+    key = (level, tx, ty)
+    if key in self.tiles:
+      self.tiles.move_to_end(key)
+      return self.tiles[key]
+
+    box = self.tile_box(level, tx, ty)
+    if level == 0:
+      tile = self.image.im.crop(box)
+    else:
+      #joining the (up to) four tiles under this one and shrinking them to half
+      below = self.level_size(level - 1)
+      size = (min(2 * box[2], below[0]) - 2 * box[0], min(2 * box[3], below[1]) - 2 * box[1])
+      joined = Image.new('RGB', size)
+      for x, y, part in self.tiles_in(level - 1, (2 * box[0], 2 * box[1], 2 * box[2], 2 * box[3])):
+        joined.paste(self.get_tile(level - 1, x, y), (part[0] - 2 * box[0], part[1] - 2 * box[1]))
+      tile = joined.reduce(2)
+
+    self.tiles[key] = tile
+    if len(self.tiles) > self.cache_size:
+      self.tiles.popitem(last = False)
+    return tile
+
+  def invalidate(self, boxes):
+    '''
+    input: [list of (left, top, right, bottom)] changed parts of the image, in pixels of level 0
+    output: [list of (level, tx, ty)] tiles that covered them, dropped from the cache to be made again
+    '''
+    dropped = []
+    for box in boxes:
+      for level in range(self.levels):
+        factor = 2 ** level
+        scaled = (box[0] / factor, box[1] / factor, box[2] / factor, box[3] / factor)
+        for tx, ty, part in self.tiles_in(level, scaled):
+          dropped.append((level, tx, ty))
+          self.tiles.pop((level, tx, ty), None)
+    return dropped
+
+
+class ExportCancelled(Exception):
+  pass
+
+
+def FilterRows(rows, prior, bpp):
+  '''
+  input: [uint8 array of shape (n, stride)] rows of a png, [uint8 array of shape (stride,)] row above them
+         (zeros for the first row of the image), bytes per pixel
+  output: [uint8 array of shape (n, stride + 1)] every row with its filter type in front, the png filter
+          (None, Sub, Up, Average or Paeth) with the smallest sum of absolute differences chosen for each row
+  '''
+  x = rows.astype(np.int16)
+  b = np.vstack((prior[None, :].astype(np.int16), x[:-1]))    #byte above
+  a = np.zeros_like(x)    #byte to the left
+  a[:, bpp:] = x[:, :-bpp]
+  c = np.zeros_like(x)    #byte above and to the left
+  c[:, bpp:] = b[:, :-bpp]
+
+  p = a + b - c
+  pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+  paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+  filtered = np.stack((x, x - a, x - b, x - (a + b) // 2, x - paeth)).astype(np.uint8)
+
+  #sum of bytes read as signed, the usual guess of which filter compresses best
+  cost = np.abs(filtered.view(np.int8).astype(np.int32)).sum(axis=2)
+  kind = np.argmin(cost, axis=0)
+  result = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+  result[:, 0] = kind
+  result[:, 1:] = filtered[kind, np.arange(len(rows))]
+  return result
+
+
+def WritePNG(im, f, compress_level = 1, progress = None, cancelled = None, filtered = False):
+  '''
+  input: RGB or RGBA PIL image, file open for writing bytes, zlib level (0 to 9),
+         progress(fraction done) called after every band of rows, cancelled() checked before every band,
+         filtered to pick a png filter for every row (about half the size, slower) instead of none
+  Writes im as a png, PNG_BAND_ROWS rows at a time, raises ExportCancelled once cancelled() is true.
+  '''
+  def chunk(kind, data):
+    f.write(struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data)))
+
+  color_type = {"RGB": 2, "RGBA": 6}[im.mode]
+  f.write(b"\x89PNG\r\n\x1a\n")
+  chunk(b"IHDR", struct.pack(">IIBBBBB", im.width, im.height, 8, color_type, 0, 0, 0))
+  compressor = zlib.compressobj(compress_level)
+  stride = im.width * len(im.mode)
+  prior = np.zeros(stride, dtype=np.uint8)
+  for top in range(0, im.height, PNG_BAND_ROWS):
+    if cancelled is not None and cancelled():
+      raise ExportCancelled()
+    bottom = min(top + PNG_BAND_ROWS, im.height)
+    band = im.crop((0, top, im.width, bottom)).tobytes()
+    if filtered:
+      band = np.frombuffer(band, dtype=np.uint8).reshape(bottom - top, stride)
+      rows = FilterRows(band, prior, len(im.mode)).tobytes()
+      prior = band[-1]
+    else:
+      #every row starts with filter type 0 (none)
+      rows = b"".join(b"\x00" + band[i:i + stride] for i in range(0, len(band), stride))
+    data = compressor.compress(rows)
+    if len(data) != 0:
+      chunk(b"IDAT", data)
+    if progress is not None:
+      progress(bottom / im.height)
+  chunk(b"IDAT", compressor.flush())
+  chunk(b"IEND", b"")
+
+
+class ExportJob:
+
+  # saves a snapshot of an image in a background thread. format is a key of EXPORT_FORMATS, options override
+  # its default options. progress(job) is called from the thread whenever job.progress changes and once more
+  # when it's done, cancelled or failed. seconds and size (bytes) are set once the file is written.
+  def __init__(self, im, path, format = "png", options = None, progress = None):
+    self.im = im
+    self.path = path
+    self.format = format
+    self.options = dict(EXPORT_FORMATS[format][2], **(options or {}))
+    self.callback = progress
+    self.progress = 0
+    self.done = False
+    self.cancelled = False
+    self.error = None
+    self.seconds = None
+    self.size = None
+    self.stop = Event()
+    self.thread = Thread(target = self.run, daemon = True)
+
+  # starts the export, returns the job
+  def start(self):
+    self.thread.start()
+    return self
+
+  # asks the export to stop, the partly written file is removed
+  def cancel(self):
+    self.stop.set()
+
+  # waits for the export to end, returns the job
+  def wait(self, timeout = None):
+    self.thread.join(timeout)
+    return self
+
+  # sets progress and lets the callback know
+  def report(self, progress):
+    self.progress = progress
+    if self.callback is not None: self.callback(self)
+
+  def run(self):
+    '''
+    Writes the file next to path first and renames it once complete, so path is never left half written
+    '''
+    start = time.time()
+    temp = self.path + ".part"
+    try:
+      with open(temp, "wb") as f:
+        if self.format == "png":
+          WritePNG(self.im, f, self.options["compress_level"], self.report, self.stop.is_set, self.options["filtered"])
+        else:
+          #PIL encodes these in one go, so progress only moves when it's done
+          if self.stop.is_set(): raise ExportCancelled()
+          self.im.save(f, EXPORT_FORMATS[self.format][1], **self.options)
+      if self.stop.is_set(): raise ExportCancelled()
+      os.replace(temp, self.path)
+      self.seconds = time.time() - start
+      self.size = os.path.getsize(self.path)
+      self.done = True
+      self.report(1)
+    except ExportCancelled:
+      self.cancelled = True
+    except Exception as e:
+      self.error = e
+    if os.path.exists(temp):
+      os.remove(temp)
+    if not self.done: self.report(self.progress)
+
 
 class MyImage:
   
-  def __init__(self, path):
-    self.worldmap = Image.open("static/worldmap.jpg").convert('RGB')
-    self.im = Image.open(path).convert('RGB')
-    self.draw = ImageDraw.Draw(self.im)
+  def __init__(self, path, im = None):
+    '''
+    path is the map image to draw on, im an already loaded copy of it to use instead of opening path
+    Stations and connections are drawn on the base image, every added route on its own RouteLayer.
+    im is the base with the layers composited over it, it is the base itself while there are no routes.
+    '''
+    self.projection = GetProjection("static/worldmap.jpg")
+    self.base = Image.open(path).convert('RGB') if im is None else im
+    self.im = self.base
+    self.draw = ImageDraw.Draw(self.base)
     self.pixels = self.im.load()
+    self.layers = []    #route layers shown, bottom first
+    self.removed = {}   #colors of routes removed, {tuple(path): color}, to bring them back in it
+    self.dirty = [(0, 0, self.base.width, self.base.height)]   #boxes of im changed since take_dirty, all of it at start
     self.path = path
     self.width = self.im.width
     self.height = self.im.height
     self.path_width = 11
     self.done = 0
 
+  @classmethod
+  def with_network(cls, path, style = None, verbose = False):
+    '''
+    input: path of the map image, style of the network (BASE_STYLE by default)
+    output: MyImage with all routes and stations already drawn, copied from the cached base map
+    '''
+    return cls(path, GetBaseMap(path, style, verbose).copy())
+
   def closest_stn_to_pixel(self, x, y):
     '''
     input: pixel loc on our map
     output: [Station code string] returns closest stn code to the given pixel
     '''
+    #finding closest station in the KD-tree of station pixels
+    codes, tree = self.get_pixel_index()
+    distance, idx = tree.nearest((x, y))
+    return codes[idx[0]]
+
+  def get_pixel_index(self):
+    '''
+    output: [list] station codes, [KDTree] over pixel location of those stations
+    projects all stations once per world map size and station data, later calls reuse the tree
+    '''
+    key = (self.projection.key(), dataset_.get_hash())
+    if key not in pixel_index_:
+      registry = dataset_.get_registry()
+      pixel_index_[key] = (registry.codes, KDTree(self.station_pixels()))
+    return pixel_index_[key]
+
+  def station_pixels(self):
+    '''
+    output: [array of shape (n, 2)] pixel location of every station, in the order of the station registry
+    '''
+    return self.projection.station_pixels()
 
-    xs = []
-    ys = []
-    code = []
-
-    #finding the distance of all stations and return whichever is closest
-    for i, j, k in zip(data_["Latitude"].to_list(), data_["Longitude"].to_list(), data_["code"].to_list()):
-      x_, y_ = self.convert_cord_to_pix((i,j))
-      xs.append(x_)
-      ys.append(y_)
-      code.append(k)
-    xs = np.array(xs)
-    ys = np.array(ys)
-    x_delta = (xs - x)**2
-    y_delta = (ys - y)**2
-    delta = np.sqrt(x_delta + y_delta)
-    idx = np.argmin(delta)
-
-    return code[idx]
+  def station_pixel(self, code):
+    '''
+    input: station code
+    output: [x, y] pixel location of the station on the map
+    '''
+    return self.projection.station_pixel(code)
   
   def plot_given_stations(self, stations, color = "red", radius = 9, verbose = False):
     '''
@@ -61,20 +599,19 @@ class MyImage:
     output:
        Plots given amtrak stations on the map.
     '''
+    graph_ = dataset_.graph
     
     smaller_radius = radius - 4
     normal_radius = radius
     count = 0
     for k in stations:
-      i = data_[data_["code"] == k]["Latitude"].to_numpy()[0]
-      j = data_[data_["code"] == k]["Longitude"].to_numpy()[0]
       count += 1
       if graph_[k].is_closely_packed():
         radius = smaller_radius
       else:
         radius = normal_radius
       if verbose and (count % 125 == 0): print(count, "stations plotted")
-      x, y = self.convert_cord_to_pix((i,j))
+      x, y = self.station_pixel(k)
       self.draw_circle((x, y), color = color, radius = radius, text = k)
 
   def plot_stations(self, color = "red", radius = 9, verbose = False):
@@ -82,17 +619,18 @@ class MyImage:
     input: color of station points, radius of those points, verbose
     Plots all amtrak stations
     '''
+    graph_ = dataset_.graph
     smaller_radius = radius - 4
     normal_radius = radius
     count = 0
-    for i, j, k in zip(data_["Latitude"].to_list(), data_["Longitude"].to_list(), data_["code"].to_list()):
+    for k in dataset_.get_registry().codes:
       count += 1
       if graph_[k].is_closely_packed():
         radius = smaller_radius
       else:
         radius = normal_radius
       if verbose and (count % 125 == 0): print(count, "stations plotted")
-      x, y = self.convert_cord_to_pix((i,j))
+      x, y = self.station_pixel(k)
       self.draw_circle((x, y), color = color, radius = radius, text = k)
   
   def plot_given_paths(self, stations, color = "white", width = 8, verbose = False):
@@ -100,6 +638,7 @@ class MyImage:
     input: list of route stations, color of station paths, width of those paths, verbose
     Plots paths between given amtrak stations
     '''
+    graph_ = dataset_.graph
 
     smaller_width = int(width / 2) 
     normal_width = int(width)
@@ -110,8 +649,7 @@ class MyImage:
       
       #finding cordinate of station
       if verbose and (count % 125 == 0): print(count, "paths printed")
-      x, y = data_[data_["code"] == i.id]["Latitude"].to_list()[0], data_[data_["code"] == i.id]["Longitude"].to_list()[0]
-      x, y = self.convert_cord_to_pix((x,y))
+      x, y = self.station_pixel(i.id)
 
       #checking if stations are closely packed, if yes then width of lines would be small
       if i.is_closely_packed():
@@ -121,8 +659,7 @@ class MyImage:
   
       #plot connections
       for j in i.get_connections():
-        xn, yn = data_[data_["code"] == j]["Latitude"].to_list()[0], data_[data_["code"] == j]["Longitude"].to_list()[0]
-        xn, yn = self.convert_cord_to_pix((xn,yn))
+        xn, yn = self.station_pixel(j)
         self.draw_line((x, y), (xn, yn), color = color, w = width)
 
   def plot_paths(self, color = "white", width = 8, verbose = False):
@@ -130,6 +667,7 @@ class MyImage:
     input: color of station paths, width of those paths, verbose
     Plots all routes
     '''
+    graph_ = dataset_.graph
 
     smaller_width = int(width / 2) 
     normal_width = int(width)
@@ -139,8 +677,7 @@ class MyImage:
       
       #finding cordinate of station
       if verbose and (count % 125 == 0): print(count, "paths printed")
-      x, y = data_[data_["code"] == i.id]["Latitude"].to_list()[0], data_[data_["code"] == i.id]["Longitude"].to_list()[0]
-      x, y = self.convert_cord_to_pix((x,y))
+      x, y = self.station_pixel(i.id)
 
       #checking if stations are closely packed, if yes then width of lines would be small
       if i.is_closely_packed():
@@ -150,31 +687,93 @@ class MyImage:
   
       #plot connections
       for j in i.get_connections():
-        xn, yn = data_[data_["code"] == j]["Latitude"].to_list()[0], data_[data_["code"] == j]["Longitude"].to_list()[0]
-        xn, yn = self.convert_cord_to_pix((xn,yn))
+        xn, yn = self.station_pixel(j)
         self.draw_line((x, y), (xn, yn), color = color, w = width)
   
+  def network_shapes(self, path_color = "white", path_width = 8, station_color = "red", station_radius = 9):
+    '''
+    output: [list of (x1, y1, x2, y2, color, width)] lines of all connections, in the order plot_paths draws them,
+            [list of (x, y, radius, color, code)] circles of all stations, in the order plot_stations draws them
+    '''
+    graph_ = dataset_.graph
+    lines = []
+    for i in graph_.get_stations():
+      width = int(path_width / 2) if i.is_closely_packed() else int(path_width)
+      x, y = self.station_pixel(i.id)
+      for j in i.get_connections():
+        xn, yn = self.station_pixel(j)
+        lines.append((x, y, xn, yn, path_color, width))
+
+    circles = []
+    for k in dataset_.get_registry().codes:
+      radius = station_radius - 4 if graph_[k].is_closely_packed() else station_radius
+      x, y = self.station_pixel(k)
+      circles.append((x, y, radius, station_color, k))
+    return lines, circles
+
+  def plot_network(self, path_color = "white", path_width = 8, station_color = "red", station_radius = 9,
+                   workers = None, tile_size = RENDER_TILE_SIZE, verbose = False):
+    '''
+    input: colors and sizes of paths and stations as for plot_paths and plot_stations, number of worker
+           processes (all cores by default), size of the tiles they draw, verbose
+    Plots all routes and then all stations, same as plot_paths and plot_stations. With more than one worker
+    the map is cut into tiles, every tile is drawn with the shapes overlapping it in a separate process,
+    and the tiles are pasted back. A tile is drawn on the part of the map covering all its shapes, as PIL
+    draws lines cut by the image edge differently. Still a few pixels on line edges can differ from
+    plot_paths, where PIL rounds shifted coordinates differently.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+      self.plot_paths(path_color, path_width, verbose)
+      self.plot_stations(station_color, station_radius, verbose)
+      return
+
+    t = time.time()
+    lines, circles = self.network_shapes(path_color, path_width, station_color, station_radius)
+
+    #handing every shape to the tiles its bounding box overlaps, keeping the drawing order
+    shapes = {}     # {(<tx>, <ty>): [[<lines>], [<circles>], <box covering tile and its shapes>]}
+    def assign(box, shape, kind):
+      box = self.clip(box)
+      if box is None:
+        return
+      for ty in range(box[1] // tile_size, (box[3] - 1) // tile_size + 1):
+        for tx in range(box[0] // tile_size, (box[2] - 1) // tile_size + 1):
+          if (tx, ty) not in shapes:
+            tile_box = (tx * tile_size, ty * tile_size, (tx + 1) * tile_size, (ty + 1) * tile_size)
+            shapes[(tx, ty)] = [[], [], self.clip(tile_box)]
+          shapes[(tx, ty)][kind].append(shape)
+          shapes[(tx, ty)][2] = MergeBoxes((shapes[(tx, ty)][2], box))
+    for line in lines:
+      x1, y1, x2, y2, color, width = line
+      assign((min(x1, x2) - width, min(y1, y2) - width, max(x1, x2) + width + 1, max(y1, y2) + width + 1), line, 0)
+    for circle in circles:
+      x, y, radius, color, code = circle
+      offset = int(np.sqrt(2) * radius) + 3
+      text_width = GetFont().getbbox(code)[2]
+      assign((x - radius - 1, y - offset - LABEL_MARGIN - 1, x + offset + text_width + LABEL_MARGIN + 1, y + radius + 2),
+             circle, 1)
+
+    tasks = []
+    for (tx, ty), (tile_lines, tile_circles, box) in sorted(shapes.items()):
+      tasks.append((self.base.crop(box), box[:2], tile_lines, tile_circles))
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+      for (tx, ty), task, drawn in zip(sorted(shapes), tasks, pool.map(RenderTile, tasks)):
+        #pasting back only the tile itself
+        left, top = tx * tile_size - task[1][0], ty * tile_size - task[1][1]
+        right, bottom = min(left + tile_size, drawn.width), min(top + tile_size, drawn.height)
+        self.base.paste(drawn.crop((left, top, right, bottom)), (tx * tile_size, ty * tile_size))
+    self.base_changed((0, 0, self.width, self.height))
+    if verbose: print(len(tasks), "tiles drawn by", workers, "processes in", round(time.time() - t, 3), "secs")
+
   def convert_cord_to_pix(self, cords):
     '''
-    input: tuple of cordinates of any location
+    input: tuple of cordinates of any location (or tuple of latitude array and longitude array)
     output: tuple of pixel location on the umage
     Using world map to calculate cordinates and translating and scaling those to 
     US map.
     '''  
-    #calculating pixels values (x and y) from cordinates
-    image_size_factor = 4
-    x = (cords[1] + 180) * (self.worldmap.width / 360)
-    latRad = cords[0]  * np.pi / 180
-    mercN = np.log(np.tan((np.pi / 4) + (latRad / 2)))
-    y = (self.worldmap.height / 2) - (self.worldmap.width * mercN / (2 * np.pi))
-    
-    #translating those pixels from world map to us map
-    x_corrected, y_corrected = x + 8, y + 4
-    x_offset = 1146
-    y_offset = 1862
-    x_new = image_size_factor*(x_corrected - x_offset)
-    y_new = image_size_factor*(y_corrected - y_offset)
-    return x_new, y_new 
+    return self.projection.project(cords[0], cords[1])
  
   def get_width(self):
     return self.width
@@ -182,12 +781,14 @@ class MyImage:
   def get_height(self):
     return self.height
     
-  def draw_circle(self, coordinate, color ='green', radius=10, text = None):
+  def draw_circle(self, coordinate, color ='green', radius=10, text = None, draw = None):
     '''
     param coordiante is a tuple with the x and y coordinates (in the pixel) of the center of the circle
     param color is a string of the color to be drawn.  for example: 'green'
     param radius is the radius of the circle to draw
+    param draw is the ImageDraw to draw with, the base image by default
     '''
+    target = self.draw if draw is None else draw
 
     #get center of circle
     centerx = coordinate[0]
@@ -200,93 +801,225 @@ class MyImage:
     y2 = centery + radius
 
     #draw the circle
-    self.draw.ellipse((x1, y1, x2, y2), fill = color, outline =color)
+    target.ellipse((x1, y1, x2, y2), fill = color, outline =color)
+    box = (x1, y1, x2 + 1, y2 + 1)
 
-    #if text is not none add text in image
-    if (text == None): return
-    title_font = ImageFont.truetype('OpenSans-BoldItalic.ttf', 15)
-    title_text = text
-    offset = int(np.sqrt(2) * radius) + 3
-    self.draw.text((coordinate[0] + offset, coordinate[1] - offset), title_text, (245, 233, 66), font = title_font)
+    #if text is not none add text in image, pasting its cached label when drawing on the base
+    if (text != None):
+      offset = int(np.sqrt(2) * radius) + 3
+      x, y = coordinate[0] + offset, coordinate[1] - offset
+      if draw is None:
+        text_box = DrawLabel(self.base, self.draw, text, x, y)
+      else:
+        target.text((x, y), text, LABEL_COLOR, font = GetFont())
+        text_box = target.textbbox((x, y), text, font = GetFont())
+      box = (min(box[0], text_box[0]), min(box[1], text_box[1]), max(box[2], text_box[2]), max(box[3], text_box[3]))
+
+    if draw is None: self.base_changed(box)
 
-  def draw_line(self, start, end, color='blue', w=5):
+  def draw_line(self, start, end, color='blue', w=5, draw = None):
     '''
     start is a tuple with the x and y coordinates (in the pixel) of the start point on the line, likewise
     end is a tuple with the x and y coordinates (in the pixel) of the end point on the line
     color is a string which represents a color to use for the line fill in
     w is the width of the line to draw
+    draw is the ImageDraw to draw with, the base image by default
     '''
     #get points to define the start and end of line
     x1 = start[0]
     y1 = start[1]
     x2 = end[0]
     y2 = end[1]
+    if draw is not None:
+      draw.line((x1, y1, x2, y2), fill = color, width = w)
+      return
     self.draw.line((x1, y1, x2, y2), fill = color, width = w)
+    self.base_changed((min(x1, x2) - w, min(y1, y2) - w, max(x1, x2) + w + 1, max(y1, y2) + w + 1))
+
+  def base_changed(self, box):
+    '''
+    box is the part of the base image just drawn on, it's composited again if routes are shown over it
+    '''
+    if self.im is not self.base:
+      self.refresh(box)
+    else:
+      self.mark_dirty(box)
+
+  def mark_dirty(self, box):
+    '''
+    records box as changed in im, once there are more than DIRTY_LIMIT boxes they're merged into one
+    '''
+    box = self.clip(box)
+    if box is None:
+      return
+    self.dirty.append(box)
+    if len(self.dirty) > DIRTY_LIMIT:
+      self.dirty = [MergeBoxes(self.dirty)]
+
+  def take_dirty(self):
+    '''
+    output: [list of (left, top, right, bottom)] parts of im changed since the last call, overlapping boxes merged
+    clears the changed boxes, so the caller is expected to redraw these parts
+    '''
+    boxes = []
+    for box in self.dirty:
+      #merging box with every box it overlaps until none overlap
+      merged = True
+      while merged:
+        merged = False
+        for i in range(len(boxes)):
+          if box[0] < boxes[i][2] and boxes[i][0] < box[2] and box[1] < boxes[i][3] and boxes[i][1] < box[3]:
+            box = MergeBoxes((box, boxes.pop(i)))
+            merged = True
+            break
+      boxes.append(box)
+    self.dirty = []
+    return boxes
+
+  def clip(self, box):
+    '''
+    returns box (left, top, right, bottom) rounded outwards to whole pixels and cut to the image, None if it's outside
+    '''
+    left, top = max(int(np.floor(box[0])), 0), max(int(np.floor(box[1])), 0)
+    right, bottom = min(int(np.ceil(box[2])), self.width), min(int(np.ceil(box[3])), self.height)
+    if left >= right or top >= bottom:
+      return None
+    return (left, top, right, bottom)
+
+  def refresh(self, box):
+    '''
+    composites box of the image again from the base and the route layers over it, nothing else is touched
+    '''
+    box = self.clip(box)
+    if box is None:
+      return
+    region = self.base.crop(box).convert('RGBA')
+    for layer in self.layers:
+      part = layer.overlap(box)
+      if part is None:
+        continue
+      source = (part[0] - layer.box[0], part[1] - layer.box[1], part[2] - layer.box[0], part[3] - layer.box[1])
+      region.alpha_composite(layer.im, dest = (part[0] - box[0], part[1] - box[1]), source = source)
+    self.im.paste(region.convert('RGB'), box[:2])
+    self.mark_dirty(box)
   
-  def animate(self):
-    #helper function for save image
-    count = 0
-    while True:
-      count += 1
-      if self.done:
-        break
-      print("\r", "Saving the output image. ", "|", "⡿" * count, " " * (15 - count), "|", end = "", sep="", flush=True)
-      time.sleep(0.6)
-  
+  def export(self, path = "out.png", format = None, options = None, progress = None):
+    '''
+    input: path in the out folder, format (a key of EXPORT_FORMATS, from the extension of path by default),
+           options of the format (like compress_level or quality), progress(job) callback
+    output: [ExportJob] started job saving a copy of the image as it is now, later drawing doesn't change it
+    '''
+    if format is None:
+      extension = os.path.splitext(path)[1].lower()
+      format = [name for name, (ext, pil, default) in EXPORT_FORMATS.items() if ext == extension or "." + name == extension]
+      format = format[0] if len(format) != 0 else "png"
+    os.makedirs("out", exist_ok=True)
+    return ExportJob(self.im.copy(), os.path.join("out", path), format, options, progress).start()
+
   def save_img(self, path = "out.png", verbose = False):
     ''''
     This function saves the modified image file (after doing drawing items) to the out folder
+    returns the ExportJob once it has ended
     '''
-    if verbose: 
-      ch = Thread(target= self.animate, daemon=True)
-      ch.start()
-    self.im.save("out/" + path)
-    if verbose: self.done = 1
+    def show(job):
+      print("\r", "Saving the output image. ", str(int(job.progress * 100)).rjust(3), "%", end = "", sep="", flush=True)
+    job = self.export(path, progress = show if verbose else None).wait()
     if verbose: print()
-    if verbose: self.done = 0
-  
+    if verbose and job.done: print("saved", job.path, "in", round(job.seconds, 3), "secs,", job.size, "bytes")
+    if job.error is not None: raise job.error
+    return job
+
   def add_path(self, path):
     '''
     input: list of connected station codes
-    output: draws the path on image
+    output: [RouteLayer] layer the path is drawn on, -1 if path is too short
+    The path gets its own layer composited over the map, only its bounding box is touched.
+    A path removed earlier comes back in its old color, a path already shown is drawn again
+    in a new color on top, keeping one layer per path.
     todo: to check whether two consecutive stations are connected 
     '''
-
     if (len(path) < 2):
       return -1
 
-    #gives random but new color each time
-    random_number = random.randint(0,16777215)
-    hex_number = str(hex(random_number))
-    color = hex_number[2:]
-    while (len(color) < 6):
-      color = "0" + color
-    color = "#" + color
+    #taking the layer of a path already shown off, it's replaced by the new one
+    shown = None
+    for i in range(len(self.layers)):
+      if self.layers[i].path == list(path):
+        shown = self.layers.pop(i)
+        break
+
+    #drawing the layer again in the color the path had when it was last removed, else in a new one
+    color = self.removed.pop(tuple(path), None) if shown is None else None
+    layer = self.draw_route_layer(path, color)
+
+    #base is kept as it is from now on, routes are composited over a copy
+    if self.im is self.base:
+      self.im = self.base.copy()
+      self.pixels = self.im.load()
+    self.layers.append(layer)
+    if shown is not None:
+      self.refresh(shown.box)
+    self.im.paste(layer.im, layer.box[:2], layer.im)
+    self.mark_dirty(layer.box)
+    return layer
+
+  def remove_path(self, path):
+    '''
+    input: list of connected station codes, same as given to add_path
+    output: [RouteLayer] layer removed, -1 if path isn't shown
+    Takes the layer of the path off and composites its bounding box again,
+    so whatever was under the path shows again as it was.
+    '''
+    for i in range(len(self.layers) - 1, -1, -1):
+      if self.layers[i].path == list(path):
+        layer = self.layers.pop(i)
+        self.removed[tuple(layer.path)] = layer.color
+        self.refresh(layer.box)
+        return layer
+    return -1
+
+  def draw_route_layer(self, path, color = None):
+    '''
+    input: list of connected station codes, color of the path (a new random one by default)
+    output: [RouteLayer] path drawn on a transparent image around its stations
+    '''
+    graph_ = dataset_.graph
+    if color is None:
+      color = RandomColor()
+
+    #layer covers all stations of the path
+    points = np.array([self.station_pixel(stn) for stn in path])
+    left, top = np.floor(points.min(axis=0)).astype(int) - LAYER_MARGIN
+    right, bottom = np.ceil(points.max(axis=0)).astype(int) + LAYER_MARGIN + 1
+    box = (int(left), int(top), int(right), int(bottom))
+    im = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(im)
+    points = (points - (box[0], box[1])).tolist()
 
     #change all station nodes to respective color
     inv_color = self.find_inverted_color(color)
-    self.change_station_color(path, inv_color)
+    self.change_station_color(path, inv_color, draw, points)
 
     #draws lines between those stations.
-    prev_stn = path[0]
-    x_p, y_p = data_[data_["code"] == prev_stn]["Latitude"].to_list()[0], data_[data_["code"] == prev_stn]["Longitude"].to_list()[0]
-    x_p, y_p = self.convert_cord_to_pix((x_p, y_p))
+    x_p, y_p = points[0]
     for i in range(1, len(path)):
       stn = path[i]
       width = 9
       if graph_[stn].is_closely_packed():
         width = 4
-      x, y = data_[data_["code"] == stn]["Latitude"].to_list()[0], data_[data_["code"] == stn]["Longitude"].to_list()[0]
-      x, y = self.convert_cord_to_pix((x, y))
-      self.draw_line((x_p, y_p), (x,  y), color=color, w= width)
+      x, y = points[i]
+      self.draw_line((x_p, y_p), (x,  y), color=color, w= width, draw = draw)
       x_p, y_p = x, y
-      prev_stn = stn
 
-  def change_station_color(self, path, color):
+    return RouteLayer(path, color, box, im)
+
+  def change_station_color(self, path, color, draw = None, points = None):
     '''
     This function takes the path of all of the stations and it changes each of the stations color to the specified color
     so that it is easier to view on the map
+    draw and points are the ImageDraw to draw with and pixel location of the stations on it, base image by default
     '''
+    graph_ = dataset_.graph
     smaller_radius = 6
     normal_radius = 9
     for i in range(len(path)):
@@ -294,22 +1027,14 @@ class MyImage:
         radius = smaller_radius
       else:
         radius = normal_radius
-      x_center, y_center = data_[data_["code"] == path[i]]["Latitude"].to_list()[0], data_[data_["code"] == path[i]]["Longitude"].to_list()[0]
-      coords = self.convert_cord_to_pix((x_center,y_center))
-      self.draw_circle(coords, color=color, radius = radius)
+      coords = self.station_pixel(path[i]) if points is None else points[i]
+      self.draw_circle(coords, color=color, radius = radius, draw = draw)
 
   def find_inverted_color(self, color):
     '''
     This function takes in the string representing the hexadecimal value of a color and returns its inverted color as a hexadecimal string
     '''
-
-    hex1 = int(color[1:],16)
-    hex_max = int("ffffff",16)
-    inverted = hex_max-hex1
-    str_inverted = str(hex(inverted))[2:]
-    while (len(str_inverted) < 6):
-      str_inverted = "0" + str_inverted
-    return "#" + str_inverted
+    return InvertColor(color)
 
 
 
@@ -326,4 +1051,5 @@ class MyImage:
 #img.save_img("addedCHMtoCHIpath.png", verbose=1)
 
 
-
+if __name__ == '__main__':
+  BenchmarkLabels()
@@ -2,35 +2,123 @@
 frontend_utils.py provides utils on visualization
 '''
 from PyQt5 import QtCore
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import QRect, QRectF
+from PyQt5.QtGui import QPixmap, QPainter
 from PyQt5.QtWidgets import QApplication, QLabel, QWidget, QVBoxLayout, QPushButton, QLineEdit, QGridLayout, \
-    QScrollArea, QHBoxLayout, QSizePolicy
+    QScrollArea, QHBoxLayout, QSizePolicy, QComboBox
 from backend import *
 from frontend import *
 from image import *
 from PIL.ImageQt import ImageQt
-from threading import Thread
+from collections import OrderedDict
+import math
 import time
 import sys
 
+#paramters
+# save formats offered, {<shown name>: (<file name>, <options of the format>)}
+EXPORT_CHOICES = {"PNG (fast)": ("out.png", {"compress_level": 1}),
+                  "PNG (small)": ("out.png", {"compress_level": 6, "filtered": True}),
+                  "JPEG": ("out.jpg", {"quality": 90}),
+                  "WebP": ("out.webp", {"quality": 80})}
+
+class TileView(QWidget):
+    def __init__(self):
+        '''
+        - Widget showing a TilePyramid at any scale. Its size is the scaled image size, but only the tiles
+          inside the part being repainted (the visible part inside a scroll area) are converted and drawn,
+          from the coarsest level still sharp at that scale. No scaled copy of the whole image is made.
+        '''
+        super().__init__()
+        self.pyramid = None
+        self.scale = 1
+        self.pixmaps = OrderedDict()    #converted tiles, {(<level>, <tx>, <ty>): QPixmap}
+        self.paint_times = []   #seconds and tiles converted of every repaint
+
+    def set_pyramid(self, pyramid):
+        '''
+        Shows a new pyramid, all converted tiles are dropped
+        '''
+        self.pyramid = pyramid
+        self.pixmaps.clear()
+        self.set_scale(self.scale)
+
+    def set_scale(self, scale):
+        '''
+        Resizes the widget to the image size times scale, tiles are drawn again when they're shown
+        '''
+        self.scale = scale
+        if self.pyramid is not None:
+            self.resize(int(self.pyramid.image.width * scale), int(self.pyramid.image.height * scale))
+        self.update()
+
+    def invalidate(self, boxes):
+        '''
+        input: list of changed boxes (left, top, right, bottom) of the image
+        Drops tiles covering them and repaints those parts of the widget
+        '''
+        for key in self.pyramid.invalidate(boxes):
+            self.pixmaps.pop(key, None)
+        for box in boxes:
+            self.update(QRect(int(box[0] * self.scale), int(box[1] * self.scale),
+                              math.ceil((box[2] - box[0]) * self.scale) + 2, math.ceil((box[3] - box[1]) * self.scale) + 2))
+
+    def paintEvent(self, event):
+        '''
+        Draws the tiles overlapping the part of the widget being repainted, converting ones not converted yet
+        '''
+        if self.pyramid is None:
+            return
+        start = time.time()
+        level = self.pyramid.level_for(self.scale)
+        factor = self.scale * 2 ** level   #widget pixels per pixel of level
+
+        #repainted part of the widget in pixels of level
+        rect = event.rect()
+        box = (rect.left() / factor, rect.top() / factor, (rect.right() + 1) / factor, (rect.bottom() + 1) / factor)
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        converted = 0
+        for tx, ty, tile_box in self.pyramid.tiles_in(level, box):
+            key = (level, tx, ty)
+            if key in self.pixmaps:
+                self.pixmaps.move_to_end(key)
+            else:
+                self.pixmaps[key] = QPixmap.fromImage(ImageQt(self.pyramid.get_tile(level, tx, ty)))
+                converted += 1
+                if len(self.pixmaps) > self.pyramid.cache_size:
+                    self.pixmaps.popitem(last = False)
+            pixmap = self.pixmaps[key]
+            target = QRectF(tile_box[0] * factor, tile_box[1] * factor,
+                            (tile_box[2] - tile_box[0]) * factor, (tile_box[3] - tile_box[1]) * factor)
+            painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.end()
+        self.paint_times.append((time.time() - start, converted))
+
+
 class GUIFrontend(QWidget):
-    def __init__(self, window_name, window_width, window_height, app):
+    #emitted by the export thread, the connected slot runs on the GUI thread
+    export_progress = QtCore.pyqtSignal(object)
+
+    def __init__(self, window_name, window_width, window_height, app, verbose = False):
         '''
         input:  string  windowName
                 int     windowWidth
                 int     windowHeight
+                bool    verbose, prints time taken by every image update and repaint
         - Creates a PyQT window for visualization
         '''
         super().__init__()
         
         self.app = app
+        self.verbose = verbose
+        self.shown_image = None     #MyImage the tile pyramid was made from
+        self.update_times = {"full": [], "partial": []}     #seconds and pixels of every image update
         self.log = []  #log of all user input
         self.action = []    #log of all actions user did
 
-        #storing image for front end
-        self.my_image = MyImage("static/usmap.jpeg")
-        self.my_image.plot_paths(verbose = False)
-        self.my_image.plot_stations(verbose = False)
+        #storing image for front end, copy of the cached map with all routes and stations
+        self.my_image = MyImage.with_network("static/usmap.jpeg")
 
         self.qtApp = QApplication([])
         self.window = QWidget()
@@ -41,9 +129,7 @@ class GUIFrontend(QWidget):
         self.windowLayout = QVBoxLayout()
         self.innerL = QGridLayout()
 
-        self.image = QLabel()
-        self.image.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
-        self.image.setScaledContents(True)
+        self.image = TileView()
         self.time_click = 0     #helper variable to check if user made single or double click
         self.double_click_loc = -1  #helper variable to check what was the purpose of double click
         self.image.mousePressEvent = self.onClick
@@ -75,6 +161,12 @@ class GUIFrontend(QWidget):
         self.save_img = QPushButton("Save Image")
         self.save_img.clicked.connect(lambda: self.saveImg())
         self.innerL.addWidget(self.save_img, 0, 3, 1, 1)
+        self.export_job = None      #ExportJob of the last save
+        self.export_progress.connect(self.exportProgress, QtCore.Qt.QueuedConnection)
+        self.save_format = QComboBox()
+        for name in EXPORT_CHOICES:
+            self.save_format.addItem(name)
+        self.innerL.addWidget(self.save_format, 0, 2, 1, 1)
         self.clear_img = QPushButton("Clear Image")
         self.clear_img.clicked.connect(lambda: self.clearImg())
         self.innerL.addWidget(self.clear_img, 0, 4, 1, 1)
@@ -118,8 +210,8 @@ class GUIFrontend(QWidget):
         return super().event(event)
 
     def set_image(self, image_path):
-        pixmap = QPixmap(image_path)
-        self.image.setPixmap(pixmap)
+        self.my_image = MyImage(image_path)
+        self.putImage()
 
     def add_component(self, component):
         self.windowLayout.addWidget(component)
@@ -131,16 +223,25 @@ class GUIFrontend(QWidget):
         self.window.show()
         self.qtApp.exec()
     
-    def putImage(self):
+    def putImage(self, full = False):
         '''
         Put Images in the visualisation of the the box.
+        A new image (or full) gets a new tile pyramid, otherwise only the tiles covering parts
+        of the image changed since the last call are dropped. Visible tiles are converted when repainted.
         '''
 
-        self.qim =  ImageQt(self.my_image.im)
-        self.pixmap = QPixmap.fromImage(self.qim)
-        # self.pixmap = self.pixmap.scaledToHeight((512 + 256 + 128 + 728))
-        self.image.setPixmap(self.pixmap)
-        self.image.setAlignment(QtCore.Qt.AlignCenter)
+        start = time.time()
+        im = self.my_image.im
+        dirty = self.my_image.take_dirty()
+        if full or self.shown_image is not self.my_image:
+            mode, area = "full", im.width * im.height
+            self.image.set_pyramid(TilePyramid(self.my_image))
+            self.shown_image = self.my_image
+        else:
+            mode, area = "partial", sum((box[2] - box[0]) * (box[3] - box[1]) for box in dirty)
+            self.image.invalidate(dirty)
+        self.update_times[mode].append((time.time() - start, area))
+        if self.verbose: print(mode, "image update of", area, "pixels in", round(time.time() - start, 4), "secs")
 
         #if program started
         if (self.start == 0):
@@ -148,6 +249,19 @@ class GUIFrontend(QWidget):
                 self.zoom_out()
             self.start = 1
 
+    def timingReport(self):
+        '''
+        Prints average time and pixels changed per full and per partial image update,
+        and average time and tiles converted per repaint
+        '''
+        times = dict(self.update_times, repaint = self.image.paint_times)
+        for mode in ("full", "partial", "repaint"):
+            if len(times[mode]) == 0:
+                print(mode, "updates: none")
+                continue
+            print(mode, "updates:", len(times[mode]), ", average", round(sum(t for t, a in times[mode]) / len(times[mode]), 4),
+                  "secs,", int(sum(a for t, a in times[mode]) / len(times[mode])), "tiles" if mode == "repaint" else "pixels")
+
     def onClick(self, event):
         '''
         This function runs when user click on the map.
@@ -216,8 +330,7 @@ class GUIFrontend(QWidget):
                     return
                 self.log.append((stn1, stn2))
                 self.action.append(-1)      
-            self.my_image.plot_given_paths(path)
-            self.my_image.plot_given_stations(path)
+            self.my_image.remove_path(path)
             self.putImage()
             self.status.setText("Removed path between " + stn1 + " and " + stn2)
         else:
@@ -273,46 +386,55 @@ class GUIFrontend(QWidget):
     
     def clearImg(self):
         '''
-        Resets the image as another thread so that the user can still access other functions while this happens
+        Resets the image. It's a copy of the cached base map, quick enough to do on the GUI thread,
+        which is the only one allowed to touch the widgets
         '''
-        dh = Thread(target= self.clearImgHelper)
-        dh.start()
+        self.clearImgHelper()
 
     def clearImgHelper(self):
         '''
         Helper for clearImg, draws new image and replaces it with the current image. 
         '''
 
-        self.my_image = MyImage("static/usmap.jpeg")
-        self.my_image.plot_paths(verbose = False)
-        self.my_image.plot_stations(verbose = False)
+        self.my_image = MyImage.with_network("static/usmap.jpeg")
         self.putImage()
         self.status.setText("Cleared the Image.")
         self.log = []
         self.action = []
 
-    def animate(self):
+    def exportProgress(self, job):
         '''
-        It's the progress bar to give rough estimate of how much time the save image will take
+        It's the progress bar of the save running in the background. The ExportJob emits export_progress as it
+        writes the image, and this runs on the GUI thread once Qt delivers it
         '''
-        count = 0
-        for i in range(15):
-            count += 1
-            string = ("Saving the output image. " + "|" + ("⡿" * count) + (" " * (15 * 3 - 3 * count)) + "|")
-            self.status.setText(string)
-            time.sleep(0.6)
-        self.status.setText("Saved the image at static/out.png")
+        if job is not self.export_job:
+            return
+        if job.done:
+            self.status.setText("Saved the image at " + job.path + " in " + str(round(job.seconds, 2)) + " secs, "
+                                + str(round(job.size / 2**20, 1)) + " MB")
+        elif job.cancelled:
+            self.status.setText("Cancelled saving the image.")
+        elif job.error is not None:
+            self.status.setText("Couldn't save the image: " + str(job.error))
+        else:
+            count = int(job.progress * 15)
+            self.status.setText("Saving the output image. " + "|" + ("⡿" * count) + (" " * (15 * 3 - 3 * count)) + "| "
+                                + str(int(job.progress * 100)) + "%")
+            return
+        self.save_img.setText("Save Image")
 
     def saveImg(self):
         '''
-        Saves the image in another thread so that the user can still access other functions while this happens
+        Saves a copy of the image in the background so that the user can still access other functions while this happens
+        Pressing it again while saving cancels the save
         '''
 
-        dh = Thread(target= self.animate)
-        dh.start()
-        temp = lambda: self.my_image.save_img("out.png")
-        ch = Thread(target= temp)
-        ch.start()
+        if self.export_job is not None and self.export_job.thread.is_alive():
+            self.export_job.cancel()
+            return
+        path, options = EXPORT_CHOICES[self.save_format.currentText()]
+        self.save_img.setText("Cancel Save")
+        self.export_job = self.my_image.export(path, options = options, progress = self.export_progress.emit)
 
     def Undo(self):
         '''
@@ -338,8 +460,7 @@ class GUIFrontend(QWidget):
         path, found = findPath(stn1, stn2)
         if (found):
             if (action == 1):
-                self.my_image.plot_given_paths(path)
-                self.my_image.plot_given_stations(path)
+                self.my_image.remove_path(path)
                 self.putImage()
                 self.status.setText("Removed path between " + stn1 + " and " + stn2)
             else:
@@ -360,7 +481,7 @@ class GUIFrontend(QWidget):
 
     def scale(self, factor):
         self.scale_factor *= factor
-        self.image.resize(self.scale_factor * self.image.pixmap().size())
+        self.image.set_scale(self.scale_factor)
         self.adjust_scrollbar(self.image_scroll_area.horizontalScrollBar(), factor)
         self.adjust_scrollbar(self.image_scroll_area.verticalScrollBar(), factor)
 
@@ -369,6 +490,7 @@ class GUIFrontend(QWidget):
 
 
 if __name__ == '__main__':
+    dataset_.load(verbose = 1)
     app = QApplication(sys.argv)
     window = GUIFrontend("Amtrak Planner", 2000, 2000, app)
     window.show()
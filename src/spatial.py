@@ -0,0 +1,149 @@
+'''
+Spatial would be responsible
+- for indexing points (station coordinates or map pixels) in a KD-tree
+- for nearest and radius queries on those points
+'''
+
+import heapq
+import numpy as np
+
+#paramters
+LEAF_SIZE = 16    # max points in a leaf, leaves are scanned with one numpy operation
+EARTH_RADIUS = 3956   # earth's radius in miles
+
+
+class KDTree:
+
+    # KD-tree over points of shape (n, d). points are reordered so every node covers
+    # order[start:end], nodes = [(start, end, left, right, low, high)] where left/right are
+    # child node indices (-1 for leaves) and low/high the bounding box of its points.
+    def __init__(self, points, leaf_size = LEAF_SIZE):
+        self.points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(self.points))
+        self.nodes = []
+        if len(self.points) != 0:
+            self.build(0, len(self.points))
+
+    # builds node over order[start:end] splitting on widest dimension, returns node index
+    def build(self, start, end):
+        idx = self.order[start:end]
+        low = self.points[idx].min(axis=0)
+        high = self.points[idx].max(axis=0)
+        node = len(self.nodes)
+        self.nodes.append([start, end, -1, -1, low, high])
+        if end - start <= self.leaf_size:
+            return node
+
+        dim = int(np.argmax(high - low))
+        mid = (end - start) // 2
+        self.order[start:end] = idx[np.argpartition(self.points[idx, dim], mid)]
+        self.nodes[node][2] = self.build(start, start + mid)
+        self.nodes[node][3] = self.build(start + mid, end)
+        return node
+
+    def __len__(self):
+        return len(self.points)
+
+    # squared distance from point to bounding box of node, 0 if point is inside
+    def box_distance(self, point, node):
+        low, high = self.nodes[node][4], self.nodes[node][5]
+        delta = np.maximum(low - point, 0) + np.maximum(point - high, 0)
+        return float(np.dot(delta, delta))
+
+    def nearest(self, point, k = 1):
+        '''
+        input:  [array of shape (d,)] point, [int] k
+        output: [array] distances, [array] indices of the k closest points, closest first
+        Visits nodes in order of distance to their bounding box and stops once the box
+        of the next one is further than the k-th closest point found.
+        '''
+
+        point = np.asarray(point, dtype=np.float64)
+        if len(self.nodes) == 0:
+            return np.array([]), np.array([], dtype=np.int64)
+        best = []       # max heap of (-squared distance, index)
+        Q = [(0.0, 0)]
+        while len(Q) != 0:
+            d, node = heapq.heappop(Q)
+            if len(best) == k and d > -best[0][0]:
+                break
+            start, end, left, right = self.nodes[node][:4]
+            if left == -1:
+                idx = self.order[start:end]
+                delta = self.points[idx] - point
+                for dd, i in zip(np.einsum("ij,ij->i", delta, delta).tolist(), idx.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-dd, -i))
+                    elif dd < -best[0][0] or (dd == -best[0][0] and i < -best[0][1]):
+                        heapq.heapreplace(best, (-dd, -i))
+                continue
+            heapq.heappush(Q, (self.box_distance(point, left), left))
+            heapq.heappush(Q, (self.box_distance(point, right), right))
+
+        best = sorted((-dd, -i) for dd, i in best)
+        return np.sqrt([dd for dd, i in best]), np.array([i for dd, i in best], dtype=np.int64)
+
+    def within(self, point, radius):
+        '''
+        input:  [array of shape (d,)] point, [float] radius
+        output: [array] distances, [array] indices of all points within radius, closest first
+        '''
+
+        point = np.asarray(point, dtype=np.float64)
+        found = []
+        stack = [0] if len(self.nodes) != 0 else []
+        while len(stack) != 0:
+            node = stack.pop()
+            if self.box_distance(point, node) > radius ** 2:
+                continue
+            start, end, left, right = self.nodes[node][:4]
+            if left == -1:
+                found.append(self.order[start:end])
+            else:
+                stack.extend((left, right))
+
+        idx = np.concatenate(found) if len(found) != 0 else np.array([], dtype=np.int64)
+        distances = np.sqrt(((self.points[idx] - point) ** 2).sum(axis=1))
+        keep = distances <= radius
+        idx, distances = idx[keep], distances[keep]
+        order = np.lexsort((idx, distances))
+        return distances[order], idx[order]
+
+
+def ToUnitSphere(coords):
+    '''
+    input:  [array of shape (n, 2) or (2,)] latitudes and longitudes
+    output: [array of shape (n, 3) or (3,)] points on the unit sphere
+    straight line distance between two of these grows with the great circle distance,
+    so closest on the sphere is closest on earth.
+    '''
+    coords = np.radians(np.asarray(coords, dtype=np.float64))
+    lat, long = coords[..., 0], coords[..., 1]
+    return np.stack((np.cos(lat) * np.cos(long), np.cos(lat) * np.sin(long), np.sin(lat)), axis=-1)
+
+
+class GeoIndex:
+
+    # KD-tree over station latitudes and longitudes, distances in miles along the earth
+    def __init__(self, coords, radius = EARTH_RADIUS):
+        self.radius = radius
+        self.tree = KDTree(ToUnitSphere(np.asarray(coords, dtype=np.float64).reshape(-1, 2)))
+
+    def __len__(self):
+        return len(self.tree)
+
+    # returns (miles, indices) of k closest stations to coordinate, closest first
+    def nearest(self, coordinate, k = 1):
+        chords, idx = self.tree.nearest(ToUnitSphere(coordinate), k)
+        return self.chord_to_miles(chords), idx
+
+    # returns (miles, indices) of stations within miles of coordinate, closest first
+    def within(self, coordinate, miles):
+        chord = 2 * np.sin(min(miles / self.radius, np.pi) / 2)
+        chords, idx = self.tree.within(ToUnitSphere(coordinate), chord)
+        return self.chord_to_miles(chords), idx
+
+    # great circle distance in miles of straight line distance on the unit sphere
+    def chord_to_miles(self, chords):
+        return 2 * self.radius * np.arcsin(np.minimum(np.asarray(chords) / 2, 1))
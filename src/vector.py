@@ -0,0 +1,200 @@
+'''
+Vector would be responsible
+- for drawing the same map/routes as image.MyImage as shapes instead of pixels
+- for writing those shapes out as SVG (map pixels) or GeoJSON (latitudes and longitudes)
+'''
+
+import json
+import os
+import time
+import numpy as np
+from xml.sax.saxutils import escape, quoteattr
+from PIL import Image
+from backend import dataset_
+from image import GetProjection, RandomColor, InvertColor, LABEL_FONT, LABEL_COLOR
+
+#paramters
+SVG_DECIMALS = 2    # decimals kept of pixel locations in svg files
+GEOJSON_DECIMALS = 6    # decimals kept of latitudes and longitudes in geojson files
+
+
+class VectorImage:
+
+    # same drawing functions as MyImage, but every line and circle is kept as a shape and only written out
+    # by save_img, without a raster. shapes = [(<"line">, <code>, <code>, <color>, <width>) or
+    # (<"circle">, <code>, <color>, <radius>, <text>)] in drawing order, routes = [(<path>, <color>)]
+    # drawn over them. Only the header of the map image is read, for its size.
+    def __init__(self, path = "static/usmap.jpeg"):
+        self.projection = GetProjection("static/worldmap.jpg")
+        with Image.open(path) as im:
+            self.width, self.height = im.size
+        self.path = path
+        self.shapes = []
+        self.routes = []
+
+    def station_pixel(self, code):
+        '''
+        input: station code
+        output: [x, y] pixel location of the station on the map
+        '''
+        return self.projection.station_pixel(code)
+
+    def plot_given_stations(self, stations, color = "red", radius = 9, verbose = False):
+        '''
+        input: list of station codes, color and radius of the station points, verbose
+        Plots given amtrak stations
+        '''
+        graph_ = dataset_.graph
+        count = 0
+        for k in stations:
+            count += 1
+            if verbose and (count % 125 == 0): print(count, "stations plotted")
+            self.shapes.append(("circle", k, color, radius - 4 if graph_[k].is_closely_packed() else radius, k))
+
+    def plot_stations(self, color = "red", radius = 9, verbose = False):
+        '''
+        input: color of station points, radius of those points, verbose
+        Plots all amtrak stations
+        '''
+        self.plot_given_stations(dataset_.get_registry().codes, color, radius, verbose)
+
+    def plot_given_paths(self, stations, color = "white", width = 8, verbose = False):
+        '''
+        input: list of route stations, color of station paths, width of those paths, verbose
+        Plots paths between given amtrak stations
+        '''
+        graph_ = dataset_.graph
+        count = 0
+        for i in stations:
+            i = graph_[i]
+            count += 1
+            if verbose and (count % 125 == 0): print(count, "paths printed")
+
+            #checking if stations are closely packed, if yes then width of lines would be small
+            line_width = int(width / 2) if i.is_closely_packed() else int(width)
+            for j in i.get_connections():
+                self.shapes.append(("line", i.id, j, color, line_width))
+
+    def plot_paths(self, color = "white", width = 8, verbose = False):
+        '''
+        input: color of station paths, width of those paths, verbose
+        Plots all routes
+        '''
+        self.plot_given_paths([i.id for i in dataset_.graph.get_stations()], color, width, verbose)
+
+    def add_path(self, path):
+        '''
+        input: list of connected station codes
+        output: [tuple] (path, color) of the route added, -1 if path is too short
+        '''
+        if (len(path) < 2):
+            return -1
+        route = (list(path), RandomColor())
+        self.routes.append(route)
+        return route
+
+    def remove_path(self, path):
+        '''
+        input: list of connected station codes, same as given to add_path
+        output: [tuple] (path, color) of the route removed, -1 if path isn't shown
+        '''
+        for i in range(len(self.routes) - 1, -1, -1):
+            if self.routes[i][0] == list(path):
+                return self.routes.pop(i)
+        return -1
+
+    def route_shapes(self, path, color):
+        '''
+        output: shapes of a route drawn like MyImage.add_path, circles in inverted color first then the lines
+        '''
+        graph_ = dataset_.graph
+        inv_color = InvertColor(color)
+        shapes = [("circle", k, inv_color, 6 if graph_[k].is_closely_packed() else 9, None) for k in path]
+        for i in range(1, len(path)):
+            shapes.append(("line", path[i - 1], path[i], color, 4 if graph_[path[i]].is_closely_packed() else 9))
+        return shapes
+
+    def all_shapes(self):
+        '''
+        output: generator of every shape, the network first then the routes in the order they were added
+        '''
+        for shape in self.shapes:
+            yield shape
+        for path, color in self.routes:
+            for shape in self.route_shapes(path, color):
+                yield shape
+
+    def write_svg(self, f, include_map = True):
+        '''
+        input: text file open for writing, include_map to show the map image under the shapes
+        Writes one element per shape, in map pixels, so it can be laid over the raster map.
+        '''
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="%d" height="%d" '
+                'viewBox="0 0 %d %d">\n' % (self.width, self.height, self.width, self.height))
+        if include_map:
+            href = os.path.relpath(os.path.abspath(self.path), os.path.abspath(os.path.dirname(f.name) or "."))
+            f.write('<image xlink:href=%s x="0" y="0" width="%d" height="%d"/>\n'
+                    % (quoteattr(href.replace(os.sep, "/")), self.width, self.height))
+        f.write('<g font-family="Open Sans" font-size="%d" font-weight="bold" font-style="italic" '
+                'dominant-baseline="text-before-edge" fill="rgb%s">\n' % (LABEL_FONT[1], str(LABEL_COLOR).replace(" ", "")))
+        for shape in self.all_shapes():
+            if shape[0] == "line":
+                kind, code1, code2, color, width = shape
+                x1, y1 = np.round(self.station_pixel(code1), SVG_DECIMALS).tolist()
+                x2, y2 = np.round(self.station_pixel(code2), SVG_DECIMALS).tolist()
+                f.write('<line x1="%s" y1="%s" x2="%s" y2="%s" stroke=%s stroke-width="%d"/>\n'
+                        % (x1, y1, x2, y2, quoteattr(color), width))
+            else:
+                kind, code, color, radius, text = shape
+                x, y = np.round(self.station_pixel(code), SVG_DECIMALS).tolist()
+                f.write('<circle cx="%s" cy="%s" r="%d" fill=%s/>\n' % (x, y, radius, quoteattr(color)))
+                if text is not None:
+                    offset = int(np.sqrt(2) * radius) + 3
+                    f.write('<text x="%s" y="%s">%s</text>\n' % (round(x + offset, SVG_DECIMALS),
+                                                                 round(y - offset, SVG_DECIMALS), escape(text)))
+        f.write('</g>\n</svg>\n')
+
+    def write_geojson(self, f):
+        '''
+        input: text file open for writing
+        Writes a FeatureCollection with stations as points and connections and routes as lines,
+        one feature per line of the file.
+        '''
+        registry = dataset_.get_registry()
+        def point(code):
+            lat, long = registry.get_coords(code)
+            return [round(float(long), GEOJSON_DECIMALS), round(float(lat), GEOJSON_DECIMALS)]
+
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        first = True
+        features = [("shape", shape) for shape in self.shapes] + [("route", route) for route in self.routes]
+        for kind, item in features:
+            if kind == "route":
+                path, color = item
+                geometry = {"type": "LineString", "coordinates": [point(k) for k in path]}
+                properties = {"kind": "route", "stations": path, "color": color, "station_color": InvertColor(color)}
+            elif item[0] == "line":
+                geometry = {"type": "LineString", "coordinates": [point(item[1]), point(item[2])]}
+                properties = {"kind": "connection", "from": item[1], "to": item[2], "color": item[3], "width": item[4]}
+            else:
+                geometry = {"type": "Point", "coordinates": point(item[1])}
+                properties = {"kind": "station", "code": item[1], "color": item[2], "radius": item[3]}
+            f.write(("" if first else ",\n") + json.dumps({"type": "Feature", "geometry": geometry, "properties": properties}))
+            first = False
+        f.write('\n]}\n')
+
+    def save_img(self, path = "out.svg", verbose = False):
+        '''
+        Saves the shapes to the out folder, as GeoJSON if path ends with .geojson or .json, else as SVG
+        returns path of the file written
+        '''
+        t = time.time()
+        os.makedirs("out", exist_ok=True)
+        filename = os.path.join("out", path)
+        with open(filename, "w") as f:
+            if os.path.splitext(path)[1].lower() in (".geojson", ".json"):
+                self.write_geojson(f)
+            else:
+                self.write_svg(f)
+        if verbose: print("saved", filename, "in", round(time.time() - t, 3), "secs,", os.path.getsize(filename), "bytes")
+        return filename